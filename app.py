@@ -7,7 +7,8 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-st.markdown("""
+# Layout overrides - hide the sidebar and pull the content up
+LAYOUT_CSS = """
     <style>
     /* Obliterate sidebar */
     [data-testid="stSidebar"], [data-testid="collapsedControl"] {
@@ -29,10 +30,10 @@ st.markdown("""
         margin-top: -48px !important;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
 
 # Science.io-inspired CSS styling - FULL VERSION FROM YOUR ORIGINAL
-st.markdown("""
+THEME_CSS = """
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
     
@@ -391,7 +392,10 @@ st.markdown("""
         color: #000000 !important;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Send both style blocks as one element; Streamlit drops elements a rerun does not emit, so this runs every rerun
+st.markdown(LAYOUT_CSS + THEME_CSS, unsafe_allow_html=True)
 
 import pandas as pd
 import json
@@ -400,13 +404,437 @@ import random
 import numpy as np
 import statistics
 from typing import Dict, List, Optional, Tuple
-from collections import defaultdict
+from collections import defaultdict, Counter
+from dataclasses import dataclass, field, fields
 import tempfile
 import os
+import io
+from pandas.tseries.api import guess_datetime_format
+
+# Try to import pyarrow for the multithreaded CSV reader, but continue if not available
+try:
+    import pyarrow.csv as pacsv
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
 
 # Initialize navigation state
-if 'current_page' not in st.session_state:
-    st.session_state.current_page = 'home'
+st.session_state.setdefault('current_page', 'home')
+
+# Arrow-backed strings when pyarrow is installed - slicing runs as a single Arrow kernel
+STRING_DTYPE = 'string[pyarrow]' if PYARROW_AVAILABLE else 'string'
+
+# Standardized fuel columns and their dtypes - the only fuel columns kept after upload
+# (amount stays float64 so currency values keep their cents)
+FUEL_SCHEMA = {
+    'timestamp': 'datetime64[ns]',
+    'vehicle_id': 'category',
+    'driver_name': 'category',
+    'location': 'category',
+    'gallons': 'float32',
+    'amount': 'float64',
+    'card_last_4': STRING_DTYPE
+}
+
+def _read_csv(raw: bytes) -> pd.DataFrame:
+    """Read uploaded CSV bytes, using pyarrow's block-parallel reader when it is installed"""
+    if PYARROW_AVAILABLE:
+        try:
+            table = pacsv.read_csv(
+                io.BytesIO(raw),
+                read_options=pacsv.ReadOptions(block_size=8 << 20),
+                convert_options=pacsv.ConvertOptions(strings_can_be_null=True)
+            )
+            return table.to_pandas()
+        except Exception:
+            # pyarrow is stricter about ragged rows - let the default engine handle those files
+            pass
+    return pd.read_csv(io.BytesIO(raw))
+
+def _optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Downcast numeric columns and store repetitive text as categories to shrink large uploads"""
+    # Small files are not worth the extra passes
+    if df.memory_usage(deep=True).sum() <= 1_000_000:
+        return df
+    
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in df.select_dtypes(include='float').columns:
+        df[col] = pd.to_numeric(df[col], downcast='float')
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        if df[col].nunique() < 0.5 * len(df):
+            df[col] = df[col].astype('category')
+    
+    return df
+
+def _parse_timestamps(values: pd.Series) -> pd.Series:
+    """Parse date strings with the format guessed from the first value, falling back to per-row inference"""
+    sample = values.dropna()
+    fmt = guess_datetime_format(str(sample.iloc[0])) if len(sample) else None
+    if fmt:
+        return pd.to_datetime(values, format=fmt, errors='coerce')
+    return pd.to_datetime(values, errors='coerce')
+
+# Time-of-day layouts seen in fuel card exports (pandas cannot guess a format from a bare time)
+TIME_FORMATS = ('%H:%M:%S', '%H:%M', '%I:%M %p', '%I:%M:%S %p')
+
+def _parse_times_of_day(values: pd.Series) -> Optional[pd.Series]:
+    """Parse time-of-day values into offsets from midnight, or None when no known format matches"""
+    # Drop missing times before stringifying - astype(str) would turn NaN into a non-null 'nan'
+    sample = values.dropna()
+    if not len(sample):
+        return None
+    first = str(sample.iloc[0])
+    
+    for fmt in TIME_FORMATS:
+        try:
+            datetime.strptime(first, fmt)
+        except ValueError:
+            continue
+        times = pd.to_datetime(values, format=fmt, errors='coerce')
+        return times - times.dt.normalize()
+    
+    return None
+
+@st.cache_data(show_spinner=False)
+def _load_fuel_csv(raw: bytes) -> pd.DataFrame:
+    """Parse and standardize an uploaded fuel CSV (cached on the file bytes so reruns skip the parse)"""
+    fuel_df = _read_csv(raw)
+    
+    # Basic column standardization
+    column_mapping = {
+        'Transaction Date': 'date',
+        'Date': 'date',
+        'Transaction Time': 'time', 
+        'Time': 'time',
+        'Site Name': 'location',
+        'Merchant Name': 'location',
+        'Location': 'location',
+        'Gallons': 'gallons',
+        'Fuel Quantity': 'gallons',
+        'Vehicle Number': 'vehicle_id',
+        'Vehicle': 'vehicle_id',
+        'Amount': 'amount',
+        'Total Cost': 'amount',
+        'Driver Name': 'driver_name',
+        'Card Number': 'card_number',
+        'Card': 'card_number',
+        'Fuel Card': 'card_number',
+        'Card Last 4': 'card_last_4',
+        'Last 4': 'card_last_4',
+        'card_last4': 'card_last_4'
+    }
+    
+    # Rename columns in one pass (mapping keys missing from the upload are ignored)
+    fuel_df.rename(columns=column_mapping, inplace=True)
+    
+    # Create timestamp from date + time if separate
+    if 'date' in fuel_df.columns and 'time' in fuel_df.columns:
+        # Parse the two parts separately and add them, rather than building a joined string column
+        time_offsets = _parse_times_of_day(fuel_df['time'])
+        if time_offsets is not None:
+            fuel_df['timestamp'] = _parse_timestamps(fuel_df['date']) + time_offsets
+        else:
+            # Blank out rows missing either part so a 'nan' string is never used to guess the format
+            date_times = fuel_df['date'].astype(str) + ' ' + fuel_df['time'].astype(str)
+            fuel_df['timestamp'] = _parse_timestamps(
+                date_times.where(fuel_df['date'].notna() & fuel_df['time'].notna())
+            )
+    elif 'date' in fuel_df.columns:
+        fuel_df['timestamp'] = _parse_timestamps(fuel_df['date'])
+    
+    # Extract last 4 digits from card number if we have full card number
+    if 'card_number' in fuel_df.columns and 'card_last_4' not in fuel_df.columns:
+        fuel_df['card_last_4'] = fuel_df['card_number'].astype(STRING_DTYPE).str.slice(start=-4)
+    
+    return _apply_fuel_schema(fuel_df)
+
+def _apply_fuel_schema(fuel_df: pd.DataFrame) -> pd.DataFrame:
+    """Keep only the standardized fuel columns, cast to their FUEL_SCHEMA dtypes"""
+    columns = [col for col in FUEL_SCHEMA if col in fuel_df.columns]
+    if not columns:
+        # Unrecognized layout - keep the raw columns so Claude can still make sense of them
+        return _optimize_dtypes(fuel_df)
+    
+    fuel_df = fuel_df[columns].copy()
+    
+    # Numeric last-4 values were read as numbers - restore them as 4-digit text
+    if 'card_last_4' in columns and pd.api.types.is_numeric_dtype(fuel_df['card_last_4']):
+        fuel_df['card_last_4'] = fuel_df['card_last_4'].astype('Int64').astype(STRING_DTYPE).str.zfill(4)
+    
+    # Currency-formatted numbers such as '$1,054.22' - strip the symbols when every value then parses
+    for col in ('gallons', 'amount'):
+        if col in columns and not pd.api.types.is_numeric_dtype(fuel_df[col]):
+            numbers = pd.to_numeric(fuel_df[col].astype(str).str.replace(r'[$,\s]', '', regex=True), errors='coerce')
+            if numbers.notna().sum() == fuel_df[col].notna().sum():
+                fuel_df[col] = numbers
+    
+    for col in columns:
+        try:
+            fuel_df[col] = fuel_df[col].astype(FUEL_SCHEMA[col])
+        except (ValueError, TypeError):
+            # Values that still are not numbers - leave the column as uploaded
+            pass
+    
+    return fuel_df
+
+@st.cache_data(show_spinner=False)
+def _load_csv(raw: bytes) -> pd.DataFrame:
+    """Parse an uploaded GPS or job CSV (cached on the file bytes)"""
+    return _optimize_dtypes(_read_csv(raw))
+
+# Thresholds of the deterministic fuel rules, matching the fraud types listed in the prompt
+GALLON_LIMITS = {'VAN': 25, 'TRUCK': 50}
+RAPID_REFUEL_WINDOW = pd.Timedelta(hours=2)
+SHARED_CARD_WINDOW = pd.Timedelta(minutes=60)
+
+def _close_in_time(fuel_df: pd.DataFrame, key: str, window: pd.Timedelta) -> pd.Series:
+    """Mark rows within window of the previous or next row sharing the same key"""
+    ordered = fuel_df[[key, 'timestamp']].dropna().sort_values([key, 'timestamp'], kind='mergesort')
+    timestamps = ordered.groupby(key, observed=True, sort=False)['timestamp']
+    close = (timestamps.diff() <= window) | (timestamps.diff(-1) >= -window)
+    return close.reindex(fuel_df.index, fill_value=False)
+
+def _flag_fuel_candidates(fuel_df: pd.DataFrame) -> pd.Series:
+    """Mark fuel rows that match an after-hours, weekend, excessive, rapid refuel or shared card rule"""
+    timestamps = fuel_df['timestamp']
+    flagged = timestamps.dt.dayofweek >= 5
+    
+    # Date-only uploads parse to midnight, which says nothing about the hour of the purchase
+    if ((timestamps.dt.normalize() != timestamps) & timestamps.notna()).any():
+        hours = timestamps.dt.hour
+        flagged |= (hours < 7) | (hours >= 18)
+    
+    if 'gallons' in fuel_df.columns and 'vehicle_id' in fuel_df.columns:
+        vehicle_ids = fuel_df['vehicle_id'].astype(str).str.upper()
+        gallons = pd.to_numeric(fuel_df['gallons'], errors='coerce')
+        for vehicle_type, limit in GALLON_LIMITS.items():
+            flagged |= vehicle_ids.str.contains(vehicle_type, regex=False) & (gallons > limit)
+    
+    if 'vehicle_id' in fuel_df.columns:
+        flagged |= _close_in_time(fuel_df, 'vehicle_id', RAPID_REFUEL_WINDOW)
+    if 'card_last_4' in fuel_df.columns:
+        flagged |= _close_in_time(fuel_df, 'card_last_4', SHARED_CARD_WINDOW)
+    
+    return flagged
+
+def _find_shared_card_uses(fuel_df: pd.DataFrame) -> List[Dict]:
+    """Group uses of the same card that are each within SHARED_CARD_WINDOW of the previous one"""
+    if 'card_last_4' not in fuel_df.columns or 'timestamp' not in fuel_df.columns:
+        return []
+    
+    uses = fuel_df.dropna(subset=['card_last_4', 'timestamp']).sort_values(['card_last_4', 'timestamp'], kind='mergesort')
+    
+    # A new group starts at every card change or gap longer than the window
+    new_card = uses['card_last_4'].ne(uses['card_last_4'].shift()).fillna(True).astype(bool)
+    starts = new_card | (uses['timestamp'].diff() > SHARED_CARD_WINDOW)
+    group_ids = starts.cumsum()
+    repeated = group_ids.duplicated(keep=False)
+    uses, group_ids = uses[repeated], group_ids[repeated]
+    
+    detail_cols = [col for col in ('vehicle_id', 'driver_name', 'location') if col in uses.columns]
+    findings = []
+    for _, group in uses.groupby(group_ids, sort=False):
+        transactions = group[detail_cols].astype(object).where(group[detail_cols].notna(), None)
+        transactions.insert(0, 'timestamp', group['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+        findings.append({
+            'card_last_4': str(group['card_last_4'].iloc[0]),
+            'vehicles_involved': list(dict.fromkeys(group['vehicle_id'].dropna().astype(str))) if 'vehicle_id' in uses.columns else [],
+            'drivers_involved': list(dict.fromkeys(group['driver_name'].dropna().astype(str))) if 'driver_name' in uses.columns else [],
+            'transactions': transactions.to_dict('records'),
+            'time_span_minutes': int((group['timestamp'].iloc[-1] - group['timestamp'].iloc[0]).total_seconds() // 60)
+        })
+    
+    return findings
+
+@st.cache_resource
+def _anthropic_client():
+    """Create the Anthropic client once per server process so requests reuse its connection pool"""
+    from anthropic import Anthropic
+    return Anthropic(api_key=st.secrets["ANTHROPIC_API_KEY"])
+
+# Bump when the prompt wording, model or response parsing changes to invalidate cached analyses
+PROMPT_VERSION = "3"
+
+# User message wrapped around the uploaded data
+FRAUD_DATA_PROMPT = """Analyze this fleet data for fraud and theft. Return JSON only.
+
+{data}"""
+
+# Static detection instructions, sent as a cache_control system block so the prefix is reused across requests
+FRAUD_DETECTION_INSTRUCTIONS = """Find these fraud types:
+- After-hours fuel purchases (outside 7AM-6PM)
+- Ghost jobs (jobs scheduled but no GPS/fuel activity at location)
+- Fuel without GPS at location  
+- Excessive fuel amounts (>25 gallons for vans, >50 for trucks)
+- Rapid consecutive purchases (multiple fills within 2 hours)
+- Personal use patterns (weekend/holiday activity)
+- Jobs with no vehicle presence (cross-check GPS and fuel data)
+- SHARED CARD USE: Same card number (last 4 digits) used by different drivers/vehicles within 60 minutes
+
+SHARED CARD USE IS PRECOMPUTED:
+1. The PRECOMPUTED SHARED CARD USE section lists every group of uses of the same card (last 4 digits) within 60 minutes of each other, including same-vehicle uses
+2. Report each group as one shared_card_use violation, copying its card_last_4, vehicles_involved, drivers_involved, transactions and time_span_minutes
+3. Add the description, severity and estimated_loss for each group
+4. Do not report shared card use that is not in the precomputed list
+
+IMPORTANT: For ALL fuel-related violations, include the "card_last_4" field with the last 4 digits of the fuel card used.
+
+Return JSON:
+{
+  "violations": [
+    {
+      "type": "after_hours",
+      "vehicle_id": "VAN-004", 
+      "driver_name": "Diana",
+      "timestamp": "2024-06-16 02:00:00",
+      "location": "Shell Station",
+      "card_last_4": "5678",
+      "description": "Fuel purchase at 2 AM outside business hours",
+      "severity": "high",
+      "estimated_loss": 75.50
+    },
+    {
+      "type": "shared_card_use",
+      "card_last_4": "1234",
+      "vehicles_involved": ["VAN-001", "TRUCK-002"],
+      "drivers_involved": ["John Smith", "Mike Jones"],
+      "transactions": [
+        {"timestamp": "2024-06-16 14:15:00", "vehicle_id": "VAN-001", "driver_name": "John Smith", "location": "BP Station"},
+        {"timestamp": "2024-06-16 14:45:00", "vehicle_id": "TRUCK-002", "driver_name": "Mike Jones", "location": "Shell Station"}
+      ],
+      "time_span_minutes": 30,
+      "description": "Same fuel card (****1234) used by different drivers within 30 minutes",
+      "severity": "high",
+      "estimated_loss": 150.00
+    }
+  ],
+  "summary": {
+    "total_violations": 5,
+    "total_estimated_loss": 500.00,
+    "high_risk_vehicles": ["TRUCK001", "VAN002"]
+  }
+}"""
+
+def _run_claude(prompt: str, progress=None) -> Dict:
+    """Send the data prompt to Claude Haiku with the fraud instructions and return the parsed JSON"""
+    client = _anthropic_client()
+    
+    # Stream Claude Haiku's reply so the page shows progress instead of blocking on the full completion
+    parts = []
+    received = 0
+    with client.messages.stream(
+        model="claude-3-haiku-20240307",
+        max_tokens=4000,
+        temperature=0.1,
+        system=[{"type": "text", "text": FRAUD_DETECTION_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}}],
+        messages=[{"role": "user", "content": prompt}]
+    ) as stream:
+        for text in stream.text_stream:
+            parts.append(text)
+            received += len(text)
+            if progress is not None:
+                progress.text(f"Received {received:,} characters from Claude...")
+    
+    # Parse response
+    result_text = ''.join(parts).strip()
+    
+    # Raise rather than return so a bad response is not cached
+    if '{' not in result_text:
+        raise ValueError("Failed to get valid response from AI")
+    
+    # Decode the first JSON object and ignore any text after it (string-aware, unlike brace counting)
+    fraud_results, _ = json.JSONDecoder().raw_decode(result_text, result_text.find('{'))
+    return fraud_results
+
+class _NotCached(Exception):
+    """Raised by _cached_fraud_results on a miss - exceptions are never cached, so the next call can store the result"""
+
+# No Streamlit element calls in here: cache hits replay them, and the progress placeholder lives outside
+# Stored analyses expire after an hour so a long-running server does not serve stale results indefinitely
+@st.cache_data(show_spinner=False, ttl=3600)
+def _cached_fraud_results(prompt: str, prompt_version: str, _result: Optional[Dict] = None) -> Dict:
+    """Parsed Claude analysis per prompt and version - returns the stored result, or stores _result on a miss"""
+    if _result is None:
+        raise _NotCached()
+    return _result
+
+def _fraud_results(prompt: str, progress=None) -> Dict:
+    """Return the cached analysis for prompt, streaming a fresh one from Claude only on a miss"""
+    try:
+        return _cached_fraud_results(prompt, PROMPT_VERSION)
+    except _NotCached:
+        return _cached_fraud_results(prompt, PROMPT_VERSION, _result=_run_claude(prompt, progress))
+
+@dataclass
+class ViolationRecord:
+    """Violation fields shown on a result card, with display defaults for anything missing"""
+    type: str = 'Unknown'
+    driver_name: Optional[str] = None
+    vehicle_id: Optional[str] = None
+    timestamp: str = 'Unknown'
+    location: str = 'Unknown'
+    card_last_4: Optional[str] = None
+    vehicles_involved: List[str] = field(default_factory=list)
+    drivers_involved: List[str] = field(default_factory=list)
+    time_span_minutes: str = 'Unknown'
+    description: str = 'No description'
+    severity: str = 'Unknown'
+    estimated_loss: float = 0
+    
+    @classmethod
+    def from_dict(cls, violation: Dict) -> 'ViolationRecord':
+        """Pick the known fields out of a violation dict in one pass (null values fall back to the defaults)"""
+        return cls(**{f.name: violation[f.name] for f in fields(cls) if violation.get(f.name) is not None})
+
+def _violation_html(record: ViolationRecord) -> str:
+    """Render one violation as a collapsible result card"""
+    # Create custom expander with HTML
+    if record.type == 'shared_card_use':
+        card_last_4 = record.card_last_4 if record.card_last_4 is not None else 'Unknown'
+        vehicles = ', '.join(record.vehicles_involved)
+        
+        return f"""
+        <details style="background: #ffffff; border: 1px solid #e5e7eb; border-radius: 0.5rem; margin: 0.5rem 0;">
+            <summary style="background: #ffffff; color: #000000; font-weight: 600; padding: 1rem; cursor: pointer; border-radius: 0.5rem;">
+                <strong>Shared Card Use</strong> - Card ****{card_last_4} ({vehicles})
+            </summary>
+            <div style="padding: 1rem; color: #000000; background: #ffffff;">
+                <p style="color: #000000;"><strong>Card Last 4:</strong> ****{card_last_4}</p>
+                <p style="color: #000000;"><strong>Vehicles Involved:</strong> {vehicles}</p>
+                <p style="color: #000000;"><strong>Drivers Involved:</strong> {', '.join(record.drivers_involved)}</p>
+                <p style="color: #000000;"><strong>Time Span:</strong> {record.time_span_minutes} minutes</p>
+                <p style="color: #000000;"><strong>Description:</strong> {record.description}</p>
+                <p style="color: #000000;"><strong>Severity:</strong> {record.severity.upper()}</p>
+                <p style="color: #000000;"><strong>Estimated Loss:</strong> ${record.estimated_loss:.2f}</p>
+            </div>
+        </details>
+        """
+    
+    # Handle regular violations
+    driver = record.driver_name if record.driver_name is not None else 'Unknown'
+    vehicle = record.vehicle_id if record.vehicle_id is not None else 'Unknown'
+    driver_info = (f"{'Unknown Driver' if record.driver_name is None else driver} "
+                   f"({'Unknown Vehicle' if record.vehicle_id is None else vehicle})")
+    violation_title = record.type.replace('_', ' ').title()
+    
+    return f"""
+    <details style="background: #ffffff; border: 1px solid #e5e7eb; border-radius: 0.5rem; margin: 0.5rem 0;">
+        <summary style="background: #ffffff; color: #000000; font-weight: 600; padding: 1rem; cursor: pointer; border-radius: 0.5rem;">
+            <strong>{violation_title}</strong> - {driver_info}
+        </summary>
+        <div style="padding: 1rem; color: #000000; background: #ffffff;">
+            <p style="color: #000000;"><strong>Driver:</strong> {driver}</p>
+            <p style="color: #000000;"><strong>Vehicle:</strong> {vehicle}</p>
+            <p style="color: #000000;"><strong>Time:</strong> {record.timestamp}</p>
+            <p style="color: #000000;"><strong>Location:</strong> {record.location}</p>
+            {f"<p style='color: #000000;'><strong>Card Used:</strong> ****{record.card_last_4}</p>" if record.card_last_4 else ""}
+            <p style="color: #000000;"><strong>Description:</strong> {record.description}</p>
+            <p style="color: #000000;"><strong>Severity:</strong> {record.severity.upper()}</p>
+            <p style="color: #000000;"><strong>Estimated Loss:</strong> ${record.estimated_loss:.2f}</p>
+        </div>
+    </details>
+    """
 
 def get_demo_data():
     """Generate realistic demo data for the fleet audit"""
@@ -585,6 +1013,10 @@ def display_demo_results(scenario_name, scenario_data):
     violations = scenario_data["violations"]
     summary = scenario_data["summary"]
     
+    # Normalize once - the records feed both the severity counts and the result cards
+    records = [ViolationRecord.from_dict(violation) for violation in violations]
+    severity_counts = Counter(record.severity for record in records)
+    
     # Summary metrics - CUSTOM HTML TO FORCE VISIBILITY
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -605,7 +1037,7 @@ def display_demo_results(scenario_name, scenario_data):
         </div>
         """, unsafe_allow_html=True)
     with col3:
-        high_risk = len([v for v in violations if v.get('severity') == 'high'])
+        high_risk = severity_counts['high']
         st.markdown(f"""
         <div style="background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 0.5rem; padding: 1rem; text-align: center;">
             <div style="color: #000000; font-size: 0.875rem; font-weight: 500;">⚠️ High Risk</div>
@@ -617,52 +1049,8 @@ def display_demo_results(scenario_name, scenario_data):
     st.markdown("---")
     
     # Display violations
-    
-    for violation in violations:
-        if violation.get('type') == 'shared_card_use':
-            card_info = f"Card ****{violation.get('card_last_4', 'Unknown')}"
-            vehicles = ', '.join(violation.get('vehicles_involved', []))
-            
-            # Create custom expander with HTML
-            st.markdown(f"""
-            <details style="background: #ffffff; border: 1px solid #e5e7eb; border-radius: 0.5rem; margin: 0.5rem 0;">
-                <summary style="background: #ffffff; color: #000000; font-weight: 600; padding: 1rem; cursor: pointer; border-radius: 0.5rem;">
-                    <strong>Shared Card Use</strong> - {card_info} ({vehicles})
-                </summary>
-                <div style="padding: 1rem; color: #000000; background: #ffffff;">
-                    <p style="color: #000000;"><strong>Card Last 4:</strong> ****{violation.get('card_last_4', 'Unknown')}</p>
-                    <p style="color: #000000;"><strong>Vehicles Involved:</strong> {', '.join(violation.get('vehicles_involved', []))}</p>
-                    <p style="color: #000000;"><strong>Drivers Involved:</strong> {', '.join(violation.get('drivers_involved', []))}</p>
-                    <p style="color: #000000;"><strong>Time Span:</strong> {violation.get('time_span_minutes', 'Unknown')} minutes</p>
-                    <p style="color: #000000;"><strong>Description:</strong> {violation.get('description', 'No description')}</p>
-                    <p style="color: #000000;"><strong>Severity:</strong> {violation.get('severity', 'Unknown').upper()}</p>
-                    <p style="color: #000000;"><strong>Estimated Loss:</strong> ${violation.get('estimated_loss', 0):.2f}</p>
-                </div>
-            </details>
-            """, unsafe_allow_html=True)
-        else:
-            # Handle regular violations
-            driver_info = f"{violation.get('driver_name', 'Unknown Driver')} ({violation.get('vehicle_id', 'Unknown Vehicle')})"
-            violation_title = violation.get('type', 'Unknown').replace('_', ' ').title()
-            
-            # Create custom expander with HTML
-            st.markdown(f"""
-            <details style="background: #ffffff; border: 1px solid #e5e7eb; border-radius: 0.5rem; margin: 0.5rem 0;">
-                <summary style="background: #ffffff; color: #000000; font-weight: 600; padding: 1rem; cursor: pointer; border-radius: 0.5rem;">
-                    <strong>{violation_title}</strong> - {driver_info}
-                </summary>
-                <div style="padding: 1rem; color: #000000; background: #ffffff;">
-                    <p style="color: #000000;"><strong>Driver:</strong> {violation.get('driver_name', 'Unknown')}</p>
-                    <p style="color: #000000;"><strong>Vehicle:</strong> {violation.get('vehicle_id', 'Unknown')}</p>
-                    <p style="color: #000000;"><strong>Time:</strong> {violation.get('timestamp', 'Unknown')}</p>
-                    <p style="color: #000000;"><strong>Location:</strong> {violation.get('location', 'Unknown')}</p>
-                    {f"<p style='color: #000000;'><strong>Card Used:</strong> ****{violation['card_last_4']}</p>" if violation.get('card_last_4') else ""}
-                    <p style="color: #000000;"><strong>Description:</strong> {violation.get('description', 'No description')}</p>
-                    <p style="color: #000000;"><strong>Severity:</strong> {violation.get('severity', 'Unknown').upper()}</p>
-                    <p style="color: #000000;"><strong>Estimated Loss:</strong> ${violation.get('estimated_loss', 0):.2f}</p>
-                </div>
-            </details>
-            """, unsafe_allow_html=True)
+    for record in records:
+        st.markdown(_violation_html(record), unsafe_allow_html=True)
 
 def show_home_page():
     """Landing page content - COMPLETE VERSION"""
@@ -847,6 +1235,128 @@ def show_home_page():
     """, unsafe_allow_html=True)
     
 
+@st.fragment
+def _fraud_analysis(fuel_file, gps_file, job_file):
+    """Run button and results - a fragment, so clicking it reruns only this section, not the whole page"""
+    if st.button("🔍 Run Fraud Analysis", type="primary", use_container_width=True):
+        if fuel_file:
+            with st.spinner("Analyzing data for fraud with Claude AI..."):
+                try:
+                    # Read uploaded file - getvalue() returns the full bytes regardless of buffer position
+                    fuel_df = _load_fuel_csv(fuel_file.getvalue())
+                    
+                    # Without GPS or job data every check is a rule on the fuel rows, so only flagged rows need Claude
+                    if gps_file is None and job_file is None and 'timestamp' in fuel_df.columns:
+                        fuel_df = fuel_df[_flag_fuel_candidates(fuel_df)]
+                    
+                    # Prepare data for analysis - the fuel frame already holds only the columns the prompt refers to
+                    fuel_csv = fuel_df.dropna(how='all').to_csv(index=False)
+                    
+                    # Add GPS and Job data if available - collected as parts and joined once instead of
+                    # re-copying the growing string
+                    sections = ["FUEL DATA:\n", fuel_csv, "\n"]
+                    
+                    # Shared card use is found here in pandas; Claude only describes and prices each group
+                    shared_card_uses = json.dumps(_find_shared_card_uses(fuel_df))
+                    sections += ["\nPRECOMPUTED SHARED CARD USE:\n", shared_card_uses, "\n"]
+                    
+                    # GPS and job layouts vary by vendor, so only columns with no values at all are dropped
+                    if gps_file is not None:
+                        gps_df = _load_csv(gps_file.getvalue()).dropna(axis=1, how='all')
+                        sections += ["\nGPS DATA:\n", gps_df.to_csv(index=False), "\n"]
+                    
+                    if job_file is not None:
+                        job_df = _load_csv(job_file.getvalue()).dropna(axis=1, how='all')
+                        sections += ["\nJOB DATA:\n", job_df.to_csv(index=False), "\n"]
+                    
+                    analysis_data = ''.join(sections)
+                    
+                    # Data goes in the user message; the static instructions are sent as the cached system prompt
+                    prompt = FRAUD_DATA_PROMPT.format(data=analysis_data)
+                    
+                    # Release the frames and intermediate CSV text so only the prompt is held during the request
+                    no_candidates = fuel_df.empty
+                    del fuel_df, fuel_csv, sections, analysis_data
+                    gps_df = job_df = None
+                    
+                    if no_candidates:
+                        # Nothing matched a fraud rule - skip the Claude call entirely
+                        fraud_results = {'violations': [], 'summary': {}}
+                    else:
+                        # Call Claude Haiku (cached on the prompt, so identical data is not re-billed)
+                        progress = st.empty()
+                        fraud_results = _fraud_results(prompt, progress)
+                        progress.empty()
+                    
+                    # Display results
+                    violations = fraud_results.get('violations', [])
+                    summary = fraud_results.get('summary', {})
+                    records = [ViolationRecord.from_dict(violation) for violation in violations]
+                    severity_counts = Counter(record.severity for record in records)
+                    
+                    if violations:
+                        st.markdown("""
+                        <div style="background: #dcfce7; border: 1px solid #16a34a; border-radius: 0.5rem; padding: 1rem; color: #000000; margin: 1rem 0;">
+                            🎉 Analysis complete! Found {} potential violations.
+                        </div>
+                        """.format(len(violations)), unsafe_allow_html=True)
+                        
+                        # Display results using the same format as landing page
+                        st.markdown("<h3 style='color: #000000;'>🚨 Fraud Detection Results</h3>", unsafe_allow_html=True)
+                        
+                        # Summary metrics
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.markdown(f"""
+                            <div style="background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 0.5rem; padding: 1rem; text-align: center;">
+                                <div style="color: #000000; font-size: 0.875rem; font-weight: 500;">🚨 Violations Found</div>
+                                <div style="color: #000000; font-size: 2rem; font-weight: 700;">{len(violations)}</div>
+                                <div style="color: #dc2626; font-size: 0.875rem;">{len(violations)} issues</div>
+                            </div>
+                            """, unsafe_allow_html=True)
+                        with col2:
+                            total_loss = summary.get('total_estimated_loss', 0)
+                            st.markdown(f"""
+                            <div style="background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 0.5rem; padding: 1rem; text-align: center;">
+                                <div style="color: #000000; font-size: 0.875rem; font-weight: 500;">💰 Estimated Loss</div>
+                                <div style="color: #000000; font-size: 2rem; font-weight: 700;">${total_loss:.2f}</div>
+                                <div style="color: #dc2626; font-size: 0.875rem;">-${total_loss:.2f}</div>
+                            </div>
+                            """, unsafe_allow_html=True)
+                        with col3:
+                            high_risk = severity_counts['high']
+                            st.markdown(f"""
+                            <div style="background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 0.5rem; padding: 1rem; text-align: center;">
+                                <div style="color: #000000; font-size: 0.875rem; font-weight: 500;">⚠️ High Risk</div>
+                                <div style="color: #000000; font-size: 2rem; font-weight: 700;">{high_risk}</div>
+                                <div style="color: #dc2626; font-size: 0.875rem;">{high_risk} critical</div>
+                            </div>
+                            """, unsafe_allow_html=True)
+                        
+                        st.markdown("---")
+                        
+                        # Display violations using same format as landing page
+                        for record in records:
+                            st.markdown(_violation_html(record), unsafe_allow_html=True)
+                    else:
+                        st.markdown("""
+                        <div style="background: #dcfce7; border: 1px solid #16a34a; border-radius: 0.5rem; padding: 1rem; color: #000000; margin: 1rem 0;">
+                            🎉 Clean Fleet Audit Results - No fraud or policy violations detected!
+                        </div>
+                        """, unsafe_allow_html=True)
+                except Exception as e:
+                    st.markdown(f"""
+                    <div style="background: #fef2f2; border: 1px solid #dc2626; border-radius: 0.5rem; padding: 1rem; color: #000000; margin: 1rem 0;">
+                        ❌ Fraud detection failed: {str(e)}
+                    </div>
+                    """, unsafe_allow_html=True)
+        else:
+            st.markdown("""
+            <div style="background: #fef2f2; border: 1px solid #dc2626; border-radius: 0.5rem; padding: 1rem; color: #000000; margin: 1rem 0;">
+                ❌ Please upload fuel data to run analysis.
+            </div>
+            """, unsafe_allow_html=True)
+
 def show_product_page():
     """Product page content"""
     
@@ -893,280 +1403,7 @@ def show_product_page():
     
     # Analysis button
     st.markdown("---")
-    if st.button("🔍 Run Fraud Analysis", type="primary", use_container_width=True):
-        if fuel_file:
-            with st.spinner("Analyzing data for fraud with Claude AI..."):
-                try:
-                    # Initialize Claude with your API key
-                    from anthropic import Anthropic
-                    client = Anthropic(api_key=st.secrets["ANTHROPIC_API_KEY"])
-                    
-                    # Read uploaded file
-                    fuel_df = pd.read_csv(fuel_file)
-                    
-                    # Basic column standardization
-                    column_mapping = {
-                        'Transaction Date': 'date',
-                        'Date': 'date',
-                        'Transaction Time': 'time', 
-                        'Time': 'time',
-                        'Site Name': 'location',
-                        'Merchant Name': 'location',
-                        'Location': 'location',
-                        'Gallons': 'gallons',
-                        'Fuel Quantity': 'gallons',
-                        'Vehicle Number': 'vehicle_id',
-                        'Vehicle': 'vehicle_id',
-                        'Amount': 'amount',
-                        'Total Cost': 'amount',
-                        'Driver Name': 'driver_name',
-                        'Card Number': 'card_number',
-                        'Card': 'card_number',
-                        'Fuel Card': 'card_number',
-                        'Card Last 4': 'card_last_4',
-                        'Last 4': 'card_last_4',
-                        'card_last4': 'card_last_4'
-                    }
-                    
-                    # Rename columns
-                    for old_col, new_col in column_mapping.items():
-                        if old_col in fuel_df.columns:
-                            fuel_df = fuel_df.rename(columns={old_col: new_col})
-                    
-                    # Create timestamp from date + time if separate
-                    if 'date' in fuel_df.columns and 'time' in fuel_df.columns:
-                        fuel_df['timestamp'] = pd.to_datetime(
-                            fuel_df['date'].astype(str) + ' ' + fuel_df['time'].astype(str), 
-                            errors='coerce'
-                        )
-                    elif 'date' in fuel_df.columns:
-                        fuel_df['timestamp'] = pd.to_datetime(fuel_df['date'], errors='coerce')
-                    
-                    # Extract last 4 digits from card number if we have full card number
-                    if 'card_number' in fuel_df.columns and 'card_last_4' not in fuel_df.columns:
-                        fuel_df['card_last_4'] = fuel_df['card_number'].astype(str).str[-4:]
-                    
-                    # Prepare data for analysis
-                    fuel_csv = fuel_df.to_csv(index=False)
-                    
-                    # Add GPS and Job data if available
-                    analysis_data = f"FUEL DATA:\n{fuel_csv}\n"
-                    
-                    if gps_file is not None:
-                        gps_df = pd.read_csv(gps_file)
-                        gps_csv = gps_df.to_csv(index=False)
-                        analysis_data += f"\nGPS DATA:\n{gps_csv}\n"
-                    
-                    if job_file is not None:
-                        job_df = pd.read_csv(job_file)
-                        job_csv = job_df.to_csv(index=False)
-                        analysis_data += f"\nJOB DATA:\n{job_csv}\n"
-                    
-                    # Simple, direct prompt
-                    prompt = f"""Analyze this fleet data for fraud and theft. Return JSON only.
-
-{analysis_data}
-
-Find these fraud types:
-- After-hours fuel purchases (outside 7AM-6PM)
-- Ghost jobs (jobs scheduled but no GPS/fuel activity at location)
-- Fuel without GPS at location  
-- Excessive fuel amounts (>25 gallons for vans, >50 for trucks)
-- Rapid consecutive purchases (multiple fills within 2 hours)
-- Personal use patterns (weekend/holiday activity)
-- Jobs with no vehicle presence (cross-check GPS and fuel data)
-- SHARED CARD USE: Same card number (last 4 digits) used by different drivers/vehicles within 60 minutes
-
-CRITICAL SHARED CARD DETECTION:
-1. Look for identical card numbers or last 4 digits used across different vehicles within 60 minutes
-2. Flag even same-vehicle multiple uses within 60 minutes as suspicious
-3. Include ALL transactions in the shared_card_use violation with exact timestamps
-4. Calculate time_span_minutes between first and last use
-
-IMPORTANT: For ALL fuel-related violations, include the "card_last_4" field with the last 4 digits of the fuel card used.
-
-Return JSON:
-{{
-  "violations": [
-    {{
-      "type": "after_hours",
-      "vehicle_id": "VAN-004", 
-      "driver_name": "Diana",
-      "timestamp": "2024-06-16 02:00:00",
-      "location": "Shell Station",
-      "card_last_4": "5678",
-      "description": "Fuel purchase at 2 AM outside business hours",
-      "severity": "high",
-      "estimated_loss": 75.50
-    }},
-    {{
-      "type": "shared_card_use",
-      "card_last_4": "1234",
-      "vehicles_involved": ["VAN-001", "TRUCK-002"],
-      "drivers_involved": ["John Smith", "Mike Jones"],
-      "transactions": [
-        {{"timestamp": "2024-06-16 14:15:00", "vehicle_id": "VAN-001", "driver_name": "John Smith", "location": "BP Station"}},
-        {{"timestamp": "2024-06-16 14:45:00", "vehicle_id": "TRUCK-002", "driver_name": "Mike Jones", "location": "Shell Station"}}
-      ],
-      "time_span_minutes": 30,
-      "description": "Same fuel card (****1234) used by different drivers within 30 minutes",
-      "severity": "high",
-      "estimated_loss": 150.00
-    }}
-  ],
-  "summary": {{
-    "total_violations": 5,
-    "total_estimated_loss": 500.00,
-    "high_risk_vehicles": ["TRUCK001", "VAN002"]
-  }}
-}}"""
-                    
-                    # Call Claude Haiku with correct token limit
-                    response = client.messages.create(
-                        model="claude-3-haiku-20240307",
-                        max_tokens=4000,
-                        temperature=0.1,
-                        messages=[{"role": "user", "content": prompt}]
-                    )
-                    
-                    # Parse response
-                    result_text = response.content[0].text.strip()
-                    
-                    # Extract JSON more carefully
-                    import json
-                    
-                    if '{' in result_text:
-                        json_start = result_text.find('{')
-                        # Find the end of the JSON by counting braces
-                        brace_count = 0
-                        json_end = json_start
-                        
-                        for i, char in enumerate(result_text[json_start:], json_start):
-                            if char == '{':
-                                brace_count += 1
-                            elif char == '}':
-                                brace_count -= 1
-                                if brace_count == 0:
-                                    json_end = i + 1
-                                    break
-                        
-                        json_text = result_text[json_start:json_end]
-                        fraud_results = json.loads(json_text)
-                        
-                        # Display results
-                        violations = fraud_results.get('violations', [])
-                        summary = fraud_results.get('summary', {})
-                        
-                        if violations:
-                            st.markdown("""
-                            <div style="background: #dcfce7; border: 1px solid #16a34a; border-radius: 0.5rem; padding: 1rem; color: #000000; margin: 1rem 0;">
-                                🎉 Analysis complete! Found {} potential violations.
-                            </div>
-                            """.format(len(violations)), unsafe_allow_html=True)
-                            
-                            # Display results using the same format as landing page
-                            st.markdown("<h3 style='color: #000000;'>🚨 Fraud Detection Results</h3>", unsafe_allow_html=True)
-                            
-                            # Summary metrics
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                st.markdown(f"""
-                                <div style="background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 0.5rem; padding: 1rem; text-align: center;">
-                                    <div style="color: #000000; font-size: 0.875rem; font-weight: 500;">🚨 Violations Found</div>
-                                    <div style="color: #000000; font-size: 2rem; font-weight: 700;">{len(violations)}</div>
-                                    <div style="color: #dc2626; font-size: 0.875rem;">{len(violations)} issues</div>
-                                </div>
-                                """, unsafe_allow_html=True)
-                            with col2:
-                                total_loss = summary.get('total_estimated_loss', 0)
-                                st.markdown(f"""
-                                <div style="background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 0.5rem; padding: 1rem; text-align: center;">
-                                    <div style="color: #000000; font-size: 0.875rem; font-weight: 500;">💰 Estimated Loss</div>
-                                    <div style="color: #000000; font-size: 2rem; font-weight: 700;">${total_loss:.2f}</div>
-                                    <div style="color: #dc2626; font-size: 0.875rem;">-${total_loss:.2f}</div>
-                                </div>
-                                """, unsafe_allow_html=True)
-                            with col3:
-                                high_risk = len([v for v in violations if v.get('severity') == 'high'])
-                                st.markdown(f"""
-                                <div style="background: #f8fafc; border: 1px solid #e2e8f0; border-radius: 0.5rem; padding: 1rem; text-align: center;">
-                                    <div style="color: #000000; font-size: 0.875rem; font-weight: 500;">⚠️ High Risk</div>
-                                    <div style="color: #000000; font-size: 2rem; font-weight: 700;">{high_risk}</div>
-                                    <div style="color: #dc2626; font-size: 0.875rem;">{high_risk} critical</div>
-                                </div>
-                                """, unsafe_allow_html=True)
-                            
-                            st.markdown("---")
-                            
-                            # Display violations using same format as landing page
-                            for violation in violations:
-                                if violation.get('type') == 'shared_card_use':
-                                    card_info = f"Card ****{violation.get('card_last_4', 'Unknown')}"
-                                    vehicles = ', '.join(violation.get('vehicles_involved', []))
-                                    
-                                    st.markdown(f"""
-                                    <details style="background: #ffffff; border: 1px solid #e5e7eb; border-radius: 0.5rem; margin: 0.5rem 0;">
-                                        <summary style="background: #ffffff; color: #000000; font-weight: 600; padding: 1rem; cursor: pointer; border-radius: 0.5rem;">
-                                            <strong>Shared Card Use</strong> - {card_info} ({vehicles})
-                                        </summary>
-                                        <div style="padding: 1rem; color: #000000; background: #ffffff;">
-                                            <p style="color: #000000;"><strong>Card Last 4:</strong> ****{violation.get('card_last_4', 'Unknown')}</p>
-                                            <p style="color: #000000;"><strong>Vehicles Involved:</strong> {', '.join(violation.get('vehicles_involved', []))}</p>
-                                            <p style="color: #000000;"><strong>Drivers Involved:</strong> {', '.join(violation.get('drivers_involved', []))}</p>
-                                            <p style="color: #000000;"><strong>Time Span:</strong> {violation.get('time_span_minutes', 'Unknown')} minutes</p>
-                                            <p style="color: #000000;"><strong>Description:</strong> {violation.get('description', 'No description')}</p>
-                                            <p style="color: #000000;"><strong>Severity:</strong> {violation.get('severity', 'Unknown').upper()}</p>
-                                            <p style="color: #000000;"><strong>Estimated Loss:</strong> ${violation.get('estimated_loss', 0):.2f}</p>
-                                        </div>
-                                    </details>
-                                    """, unsafe_allow_html=True)
-                                else:
-                                    # Handle regular violations
-                                    driver_info = f"{violation.get('driver_name', 'Unknown Driver')} ({violation.get('vehicle_id', 'Unknown Vehicle')})"
-                                    violation_title = violation.get('type', 'Unknown').replace('_', ' ').title()
-                                    
-                                    st.markdown(f"""
-                                    <details style="background: #ffffff; border: 1px solid #e5e7eb; border-radius: 0.5rem; margin: 0.5rem 0;">
-                                        <summary style="background: #ffffff; color: #000000; font-weight: 600; padding: 1rem; cursor: pointer; border-radius: 0.5rem;">
-                                            <strong>{violation_title}</strong> - {driver_info}
-                                        </summary>
-                                        <div style="padding: 1rem; color: #000000; background: #ffffff;">
-                                            <p style="color: #000000;"><strong>Driver:</strong> {violation.get('driver_name', 'Unknown')}</p>
-                                            <p style="color: #000000;"><strong>Vehicle:</strong> {violation.get('vehicle_id', 'Unknown')}</p>
-                                            <p style="color: #000000;"><strong>Time:</strong> {violation.get('timestamp', 'Unknown')}</p>
-                                            <p style="color: #000000;"><strong>Location:</strong> {violation.get('location', 'Unknown')}</p>
-                                            {f"<p style='color: #000000;'><strong>Card Used:</strong> ****{violation['card_last_4']}</p>" if violation.get('card_last_4') else ""}
-                                            <p style="color: #000000;"><strong>Description:</strong> {violation.get('description', 'No description')}</p>
-                                            <p style="color: #000000;"><strong>Severity:</strong> {violation.get('severity', 'Unknown').upper()}</p>
-                                            <p style="color: #000000;"><strong>Estimated Loss:</strong> ${violation.get('estimated_loss', 0):.2f}</p>
-                                        </div>
-                                    </details>
-                                    """, unsafe_allow_html=True)
-                        else:
-                            st.markdown("""
-                            <div style="background: #dcfce7; border: 1px solid #16a34a; border-radius: 0.5rem; padding: 1rem; color: #000000; margin: 1rem 0;">
-                                🎉 Clean Fleet Audit Results - No fraud or policy violations detected!
-                            </div>
-                            """, unsafe_allow_html=True)
-                    else:
-                        st.markdown("""
-                        <div style="background: #fef2f2; border: 1px solid #dc2626; border-radius: 0.5rem; padding: 1rem; color: #000000; margin: 1rem 0;">
-                            ❌ Failed to get valid response from AI
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                except Exception as e:
-                    st.markdown(f"""
-                    <div style="background: #fef2f2; border: 1px solid #dc2626; border-radius: 0.5rem; padding: 1rem; color: #000000; margin: 1rem 0;">
-                        ❌ Fraud detection failed: {str(e)}
-                    </div>
-                    """, unsafe_allow_html=True)
-        else:
-            st.markdown("""
-            <div style="background: #fef2f2; border: 1px solid #dc2626; border-radius: 0.5rem; padding: 1rem; color: #000000; margin: 1rem 0;">
-                ❌ Please upload fuel data to run analysis.
-            </div>
-            """, unsafe_allow_html=True)
+    _fraud_analysis(fuel_file, gps_file, job_file)
 
 # Main app logic
 def main():
@@ -269,18 +269,16 @@ class FleetAuditor:
             self.gps_data is not None and not self.fuel_data.empty and not self.gps_data.empty):
             
             mpg_analyzer = MPGAnalyzer()
-            mpg_violations = []
             
-            # Analyze each vehicle
-            for vehicle_id in self.fuel_data['vehicle_id'].unique():
-                if pd.notna(vehicle_id):
-                    # Determine vehicle type
-                    vehicle_type = self._get_vehicle_type(vehicle_id, vehicle_types)
-                    
-                    vehicle_mpg_violations = mpg_analyzer.analyze_vehicle_mpg(
-                        self.fuel_data, self.gps_data, vehicle_id, vehicle_type
-                    )
-                    mpg_violations.extend(vehicle_mpg_violations)
+            # Determine vehicle type for each vehicle, then analyze the whole fleet in one pass
+            fleet_vehicle_types = {
+                vehicle_id: self._get_vehicle_type(vehicle_id, vehicle_types)
+                for vehicle_id in self.fuel_data['vehicle_id'].dropna().unique()
+            }
+            
+            mpg_violations = mpg_analyzer.analyze_fleet_mpg(
+                self.fuel_data, self.gps_data, fleet_vehicle_types
+            )
             
             audit_results['mpg_analysis'] = mpg_violations
             all_violations.extend(mpg_violations)
@@ -1,12 +1,23 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
-from .utils import calculate_distance
+from typing import Dict, List, Optional
+from .utils import cumulative_distance
 
 class MPGAnalyzer:
     """Detect fuel theft through MPG analysis - identifies odometer fraud, fuel dumping, and idle refills"""
     
+    # MPG violation categories, most severe first (same order as the fuel dumping / odometer fraud / excessive idling cut-offs):
+    # (violation_type, detection_method, description headline, description explanation, severity, confidence)
+    MPG_VIOLATION_TYPES = (
+        ('fuel_theft', 'fuel_dumping_mpg', "Fuel dumping detected",
+         "Indicates fuel dumping or major odometer manipulation.", 'high', 0.95),
+        ('fuel_theft', 'odometer_fraud_mpg', "Odometer fraud suspected",
+         "Miles may be under-reported to hide excessive fuel consumption.", 'high', 0.90),
+        ('idle_abuse', 'excessive_consumption_mpg', "Excessive fuel consumption",
+         "May indicate excessive idling or personal vehicle use.", 'medium', 0.75),
+    )
+    
     def __init__(self):
         # Expected MPG ranges for different vehicle types (conservative estimates)
         self.mpg_expectations = {
@@ -39,161 +50,171 @@ class MPGAnalyzer:
             return violations
         
         # Filter data for this vehicle
-        vehicle_fuel = fuel_df[fuel_df['vehicle_id'] == vehicle_id].copy()
-        vehicle_gps = gps_df[gps_df['vehicle_id'] == vehicle_id].copy()
+        vehicle_fuel = fuel_df[fuel_df['vehicle_id'] == vehicle_id]
+        vehicle_gps = gps_df[gps_df['vehicle_id'] == vehicle_id]
+        
+        # Sort by timestamp
+        vehicle_fuel = vehicle_fuel.sort_values('timestamp', kind='mergesort')
+        vehicle_gps = vehicle_gps.sort_values('timestamp', kind='mergesort')
+        
+        return self._analyze_vehicle_frames(vehicle_fuel, vehicle_gps, vehicle_id, vehicle_type)
+    
+    def analyze_fleet_mpg(self, fuel_df: pd.DataFrame, gps_df: pd.DataFrame,
+                          vehicle_types: Dict[str, str] = None) -> List[Dict]:
+        """
+        Analyze MPG patterns for every vehicle in the fuel data
+        
+        Splits fuel and GPS data by vehicle in a single groupby pass instead of
+        re-scanning both frames once per vehicle
+        """
+        violations = []
+        
+        if fuel_df.empty or gps_df.empty:
+            return violations
+        
+        vehicle_types = vehicle_types or {}
+        
+        # Sort both frames once; each vehicle's group below keeps this timestamp order
+        sorted_fuel = fuel_df.sort_values(['vehicle_id', 'timestamp'], kind='mergesort')
+        sorted_gps = gps_df.sort_values(['vehicle_id', 'timestamp'], kind='mergesort')
+        
+        fuel_by_vehicle = dict(iter(sorted_fuel.groupby('vehicle_id', sort=False)))
+        gps_by_vehicle = dict(iter(sorted_gps.groupby('vehicle_id', sort=False)))
+        
+        # Report vehicles in the order they appear in the fuel data
+        for vehicle_id in fuel_df['vehicle_id'].dropna().unique():
+            vehicle_fuel = fuel_by_vehicle[vehicle_id]
+            vehicle_gps = gps_by_vehicle.get(vehicle_id)
+            if vehicle_gps is None:
+                continue
+            
+            violations.extend(self._analyze_vehicle_frames(
+                vehicle_fuel, vehicle_gps, vehicle_id, vehicle_types.get(vehicle_id, 'default')
+            ))
+        
+        return violations
+    
+    def _analyze_vehicle_frames(self, vehicle_fuel: pd.DataFrame, vehicle_gps: pd.DataFrame,
+                                vehicle_id: str, vehicle_type: str = 'default') -> List[Dict]:
+        """Analyze fuel periods for one vehicle's already-filtered fuel and GPS data (put in timestamp order if needed)"""
+        violations = []
         
         if vehicle_fuel.empty or vehicle_gps.empty:
             return violations
         
-        # Sort by timestamp
-        vehicle_fuel = vehicle_fuel.sort_values('timestamp')
-        vehicle_gps = vehicle_gps.sort_values('timestamp')
+        # The binary-search slicing below needs time order - callers already sort, so this is normally just a check
+        vehicle_fuel = self._in_time_order(vehicle_fuel)
+        vehicle_gps = self._in_time_order(vehicle_gps)
         
         # Get MPG expectations for this vehicle type
         mpg_range = self.mpg_expectations.get(vehicle_type, self.mpg_expectations['default'])
         
-        # Analyze fuel periods (between fill-ups)
-        for i in range(len(vehicle_fuel) - 1):
-            current_fill = vehicle_fuel.iloc[i]
-            next_fill = vehicle_fuel.iloc[i + 1]
-            
-            # Calculate fuel consumed (assuming fill-ups)
-            fuel_consumed = next_fill['gallons'] if pd.notna(next_fill['gallons']) else None
-            
-            if fuel_consumed is None or fuel_consumed < self.violation_thresholds['minimum_fuel']:
-                continue
-            
-            # Calculate distance driven between fill-ups
-            distance = self._calculate_distance_between_times(
-                vehicle_gps, current_fill['timestamp'], next_fill['timestamp']
+        # MPG cut-offs for this vehicle, resolved once instead of per fuel period
+        mpg_thresholds = tuple(
+            mpg_range['min'] * self.violation_thresholds[key]
+            for key in ('fuel_dumping', 'odometer_fraud', 'excessive_idling')
+        )
+        min_miles = self.violation_thresholds['minimum_miles']
+        
+        # Sorted GPS columns as arrays so each fuel period can be sliced by binary search
+        gps_times = vehicle_gps['timestamp'].to_numpy()
+        gps_lats = vehicle_gps['lat'].to_numpy(dtype=float)
+        gps_lons = vehicle_gps['lon'].to_numpy(dtype=float)
+        
+        # Fuel columns as arrays to avoid per-row Series/scalar boxing
+        fill_times = vehicle_fuel['timestamp'].to_numpy()
+        fill_gallons = vehicle_fuel['gallons'].to_numpy(dtype=float)
+        fill_locations = vehicle_fuel['location'].to_numpy(dtype=object)
+        
+        # Fuel period i runs from fill i to fill i + 1; skip periods whose closing fill is missing or too small
+        valid_periods = np.flatnonzero(fill_gallons[1:] >= self.violation_thresholds['minimum_fuel'])
+        
+        # Distance driven and fuel consumed for every analyzed fuel period
+        distances = np.array([
+            self._calculate_distance_between_times(
+                gps_times, gps_lats, gps_lons, fill_times[i], fill_times[i + 1]
             )
+            for i in valid_periods
+        ], dtype=float)
+        fuel_consumed = fill_gallons[valid_periods + 1]
+        
+        # Very low miles but significant fuel consumption = idle refill or fraud
+        is_idle_refill = distances < min_miles
+        
+        # Classify all periods at once: index into MPG_VIOLATION_TYPES, -1 = no violation
+        actual_mpg = distances / fuel_consumed
+        categories = np.select([actual_mpg < threshold for threshold in mpg_thresholds], [0, 1, 2], default=-1)
+        categories[is_idle_refill] = -1
+        excess_fuel = fuel_consumed - distances / mpg_range['avg']
+        
+        for k in np.flatnonzero(is_idle_refill | (categories >= 0)):
+            fill_index = valid_periods[k] + 1
+            fill_time = pd.Timestamp(fill_times[fill_index])
+            location = fill_locations[fill_index]
             
-            if distance < self.violation_thresholds['minimum_miles']:
-                # Very low miles but significant fuel consumption = idle refill or fraud
+            if is_idle_refill[k]:
                 violations.append(self._create_idle_refill_violation(
-                    vehicle_id, next_fill, distance, fuel_consumed, mpg_range
+                    vehicle_id, fill_time, location, distances[k], fuel_consumed[k], mpg_range
+                ))
+            else:
+                violations.append(self._create_mpg_violation(
+                    categories[k], vehicle_id, fill_time, location, actual_mpg[k],
+                    distances[k], fuel_consumed[k], excess_fuel[k], mpg_range
                 ))
-                continue
-            
-            # Calculate actual MPG
-            actual_mpg = distance / fuel_consumed
-            
-            # Determine violation type based on MPG
-            violation = self._analyze_mpg_violation(
-                vehicle_id, next_fill, actual_mpg, distance, fuel_consumed, mpg_range
-            )
-            
-            if violation:
-                violations.append(violation)
         
         return violations
     
-    def _calculate_distance_between_times(self, gps_df: pd.DataFrame, 
+    def _in_time_order(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Return frame sorted by timestamp with missing times last, skipping the sort when it already is"""
+        timestamps = frame['timestamp']
+        missing = timestamps.isna()
+        present = len(timestamps) - int(missing.sum())
+        if timestamps.iloc[:present].is_monotonic_increasing and missing.iloc[present:].all():
+            return frame
+        return frame.sort_values('timestamp', kind='mergesort')
+    
+    def _calculate_distance_between_times(self, gps_times: np.ndarray, lats: np.ndarray, lons: np.ndarray,
                                         start_time: datetime, end_time: datetime) -> float:
-        """Calculate total distance driven between two timestamps"""
-        
-        # Filter GPS data to time window
-        time_filtered = gps_df[
-            (gps_df['timestamp'] >= start_time) & 
-            (gps_df['timestamp'] <= end_time)
-        ].copy()
+        """Calculate total distance driven between two timestamps (GPS arrays must be sorted by time)"""
         
-        if len(time_filtered) < 2:
+        if pd.isna(start_time) or pd.isna(end_time):
             return 0.0
         
-        total_distance = 0.0
+        # Locate the time window with binary search instead of masking the whole array
+        start = np.searchsorted(gps_times, np.datetime64(start_time), side='left')
+        end = np.searchsorted(gps_times, np.datetime64(end_time), side='right')
         
-        # Calculate cumulative distance between GPS points
-        for i in range(len(time_filtered) - 1):
-            current = time_filtered.iloc[i]
-            next_point = time_filtered.iloc[i + 1]
-            
-            # Skip if coordinates are invalid
-            if any(pd.isna([current['lat'], current['lon'], next_point['lat'], next_point['lon']])):
-                continue
-            
-            distance = calculate_distance(
-                current['lat'], current['lon'],
-                next_point['lat'], next_point['lon']
-            )
-            total_distance += distance
+        if end - start < 2:
+            return 0.0
         
-        return total_distance
+        # Cumulative distance between consecutive GPS points (segments with invalid coordinates are skipped)
+        return cumulative_distance(lats[start:end], lons[start:end])
     
-    def _analyze_mpg_violation(self, vehicle_id: str, fuel_record: pd.Series, 
-                              actual_mpg: float, distance: float, fuel_consumed: float,
-                              mpg_range: Dict) -> Optional[Dict]:
-        """Analyze if MPG indicates a violation and determine type"""
+    def _create_mpg_violation(self, category: int, vehicle_id: str, fill_time: datetime, location: str,
+                             actual_mpg: float, distance: float, fuel_consumed: float,
+                             excess_fuel: float, mpg_range: Dict) -> Dict:
+        """Create violation for a fuel period classified into MPG_VIOLATION_TYPES[category]"""
         
-        min_expected_mpg = mpg_range['min']
-        avg_expected_mpg = mpg_range['avg']
+        violation_type, detection_method, headline, explanation, severity, confidence = self.MPG_VIOLATION_TYPES[category]
         
-        # Calculate financial impact
-        expected_fuel = distance / avg_expected_mpg
-        excess_fuel = fuel_consumed - expected_fuel
-        fuel_cost = excess_fuel * 3.75  # Average fuel cost per gallon
-        
-        # Determine violation type based on severity
-        if actual_mpg < min_expected_mpg * self.violation_thresholds['fuel_dumping']:
-            # Extremely low MPG = fuel dumping or major fraud
-            return {
-                'vehicle_id': vehicle_id,
-                'timestamp': fuel_record['timestamp'],
-                'violation_type': 'fuel_theft',
-                'detection_method': 'fuel_dumping_mpg',
-                'description': f"Fuel dumping detected: {fuel_consumed:.1f} gal used, {distance:.1f} miles logged → {actual_mpg:.1f} MPG (expected: {min_expected_mpg}–{mpg_range['max']}). Indicates fuel dumping or major odometer manipulation.",
-                'location': fuel_record['location'],
-                'actual_mpg': actual_mpg,
-                'expected_mpg_range': f"{min_expected_mpg}-{mpg_range['max']}",
-                'distance_miles': distance,
-                'fuel_gallons': fuel_consumed,
-                'excess_fuel_gallons': excess_fuel,
-                'estimated_loss': fuel_cost,
-                'severity': 'high',
-                'confidence': 0.95
-            }
-        
-        elif actual_mpg < min_expected_mpg * self.violation_thresholds['odometer_fraud']:
-            # Very low MPG = odometer fraud
-            return {
-                'vehicle_id': vehicle_id,
-                'timestamp': fuel_record['timestamp'],
-                'violation_type': 'fuel_theft',
-                'detection_method': 'odometer_fraud_mpg',
-                'description': f"Odometer fraud suspected: {fuel_consumed:.1f} gal used, {distance:.1f} miles logged → {actual_mpg:.1f} MPG (expected: {min_expected_mpg}–{mpg_range['max']}). Miles may be under-reported to hide excessive fuel consumption.",
-                'location': fuel_record['location'],
-                'actual_mpg': actual_mpg,
-                'expected_mpg_range': f"{min_expected_mpg}-{mpg_range['max']}",
-                'distance_miles': distance,
-                'fuel_gallons': fuel_consumed,
-                'excess_fuel_gallons': excess_fuel,
-                'estimated_loss': fuel_cost,
-                'severity': 'high',
-                'confidence': 0.90
-            }
-        
-        elif actual_mpg < min_expected_mpg * self.violation_thresholds['excessive_idling']:
-            # Moderately low MPG = excessive idling or personal use
-            return {
-                'vehicle_id': vehicle_id,
-                'timestamp': fuel_record['timestamp'],
-                'violation_type': 'idle_abuse',
-                'detection_method': 'excessive_consumption_mpg',
-                'description': f"Excessive fuel consumption: {fuel_consumed:.1f} gal used, {distance:.1f} miles logged → {actual_mpg:.1f} MPG (expected: {min_expected_mpg}–{mpg_range['max']}). May indicate excessive idling or personal vehicle use.",
-                'location': fuel_record['location'],
-                'actual_mpg': actual_mpg,
-                'expected_mpg_range': f"{min_expected_mpg}-{mpg_range['max']}",
-                'distance_miles': distance,
-                'fuel_gallons': fuel_consumed,
-                'excess_fuel_gallons': excess_fuel,
-                'estimated_loss': fuel_cost,
-                'severity': 'medium',
-                'confidence': 0.75
-            }
-        
-        return None
+        return {
+            'vehicle_id': vehicle_id,
+            'timestamp': fill_time,
+            'violation_type': violation_type,
+            'detection_method': detection_method,
+            'description': f"{headline}: {fuel_consumed:.1f} gal used, {distance:.1f} miles logged → {actual_mpg:.1f} MPG (expected: {mpg_range['min']}–{mpg_range['max']}). {explanation}",
+            'location': location,
+            'actual_mpg': actual_mpg,
+            'expected_mpg_range': f"{mpg_range['min']}-{mpg_range['max']}",
+            'distance_miles': distance,
+            'fuel_gallons': fuel_consumed,
+            'excess_fuel_gallons': excess_fuel,
+            'estimated_loss': excess_fuel * 3.75,  # Average fuel cost per gallon
+            'severity': severity,
+            'confidence': confidence
+        }
     
-    def _create_idle_refill_violation(self, vehicle_id: str, fuel_record: pd.Series,
+    def _create_idle_refill_violation(self, vehicle_id: str, fill_time: datetime, location: str,
                                     distance: float, fuel_consumed: float, 
                                     mpg_range: Dict) -> Dict:
         """Create violation for cases where significant fuel is consumed with minimal mileage"""
@@ -203,11 +224,11 @@ class MPGAnalyzer:
         
         return {
             'vehicle_id': vehicle_id,
-            'timestamp': fuel_record['timestamp'],
+            'timestamp': fill_time,
             'violation_type': 'fuel_theft',
             'detection_method': 'idle_refill_mpg',
             'description': f"Idle refill detected: {fuel_consumed:.1f} gallons consumed with only {distance:.1f} miles driven. Vehicle may have been used for personal purposes or fuel transferred to another vehicle.",
-            'location': fuel_record['location'],
+            'location': location,
             'actual_mpg': distance / fuel_consumed if fuel_consumed > 0 else 0,
             'expected_mpg_range': f"{mpg_range['min']}-{mpg_range['max']}",
             'distance_miles': distance,
@@ -222,42 +243,29 @@ class MPGAnalyzer:
                                          time_period_days: int = 7) -> Dict:
         """Calculate financial impact per vehicle for a given time period"""
         
-        vehicle_impacts = {}
-        
-        for violation in violations:
-            vehicle_id = violation['vehicle_id']
-            estimated_loss = violation.get('estimated_loss', 0)
-            
-            if vehicle_id not in vehicle_impacts:
-                vehicle_impacts[vehicle_id] = {
-                    'total_loss': 0,
-                    'violation_count': 0,
-                    'violation_types': set(),
-                    'confidence_weighted_loss': 0
-                }
-            
-            # Add to totals
-            vehicle_impacts[vehicle_id]['total_loss'] += estimated_loss
-            vehicle_impacts[vehicle_id]['violation_count'] += 1
-            vehicle_impacts[vehicle_id]['violation_types'].add(violation.get('detection_method', 'unknown'))
-            
-            # Weight loss by confidence
-            confidence = violation.get('confidence', 1.0)
-            vehicle_impacts[vehicle_id]['confidence_weighted_loss'] += estimated_loss * confidence
-        
-        # Format results
-        formatted_results = {}
-        for vehicle_id, impact in vehicle_impacts.items():
-            formatted_results[vehicle_id] = {
-                'total_estimated_loss': impact['total_loss'],
-                'confidence_weighted_loss': impact['confidence_weighted_loss'],
-                'violation_count': impact['violation_count'],
-                'violation_methods': list(impact['violation_types']),
-                'weekly_loss_estimate': impact['total_loss'] * (7 / time_period_days) if time_period_days > 0 else 0,
-                'monthly_loss_estimate': impact['total_loss'] * (30 / time_period_days) if time_period_days > 0 else 0
-            }
-        
-        return formatted_results
+        violations_df = pd.DataFrame(violations).reindex(
+            columns=['vehicle_id', 'estimated_loss', 'confidence', 'detection_method']
+        )
+        violations_df['estimated_loss'] = violations_df['estimated_loss'].fillna(0)
+        violations_df['detection_method'] = violations_df['detection_method'].fillna('unknown')
+        
+        # Weight loss by confidence
+        violations_df['confidence_weighted_loss'] = violations_df['estimated_loss'] * violations_df['confidence'].fillna(1.0)
+        
+        # Totals, counts and methods per vehicle in a single groupby
+        impacts = violations_df.groupby('vehicle_id', sort=False).agg(
+            total_estimated_loss=('estimated_loss', 'sum'),
+            confidence_weighted_loss=('confidence_weighted_loss', 'sum'),
+            violation_count=('estimated_loss', 'size'),
+            violation_methods=('detection_method', 'unique')
+        )
+        impacts['violation_methods'] = impacts['violation_methods'].map(list)
+        
+        # Scale the period loss to weekly and monthly estimates
+        impacts['weekly_loss_estimate'] = impacts['total_estimated_loss'] * (7 / time_period_days) if time_period_days > 0 else 0
+        impacts['monthly_loss_estimate'] = impacts['total_estimated_loss'] * (30 / time_period_days) if time_period_days > 0 else 0
+        
+        return impacts.to_dict('index')
     
     def get_fleet_mpg_summary(self, violations: List[Dict]) -> Dict:
         """Generate fleet-wide MPG analysis summary"""
@@ -270,32 +278,24 @@ class MPGAnalyzer:
         if not mpg_violations:
             return {}
         
-        total_violations = len(mpg_violations)
-        total_estimated_loss = sum(v.get('estimated_loss', 0) for v in mpg_violations)
+        violations_df = pd.DataFrame(mpg_violations).reindex(
+            columns=['vehicle_id', 'detection_method', 'estimated_loss', 'actual_mpg']
+        )
+        violations_df['estimated_loss'] = violations_df['estimated_loss'].fillna(0)
+        violations_df['detection_method'] = violations_df['detection_method'].fillna('unknown')
         
         # Group by detection method
-        by_method = {}
-        for violation in mpg_violations:
-            method = violation.get('detection_method', 'unknown')
-            if method not in by_method:
-                by_method[method] = []
-            by_method[method].append(violation)
+        by_method = violations_df.groupby('detection_method', sort=False).agg(
+            count=('estimated_loss', 'size'),
+            total_loss=('estimated_loss', 'sum'),
+            avg_mpg=('actual_mpg', 'mean')
+        )
         
         summary = {
-            'total_mpg_violations': total_violations,
-            'total_estimated_weekly_loss': total_estimated_loss,
-            'violations_by_method': {
-                method: {
-                    'count': len(violations),
-                    'total_loss': sum(v.get('estimated_loss', 0) for v in violations),
-                    'avg_mpg': sum(v.get('actual_mpg', 0) for v in violations) / len(violations)
-                }
-                for method, violations in by_method.items()
-            },
-            'worst_performing_vehicle': max(
-                mpg_violations, 
-                key=lambda x: x.get('estimated_loss', 0)
-            )['vehicle_id'] if mpg_violations else None
+            'total_mpg_violations': len(violations_df),
+            'total_estimated_weekly_loss': violations_df['estimated_loss'].sum(),
+            'violations_by_method': by_method.to_dict('index'),
+            'worst_performing_vehicle': violations_df.loc[violations_df['estimated_loss'].idxmax(), 'vehicle_id']
         }
         
         return summary
\ No newline at end of file
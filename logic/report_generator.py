@@ -1,9 +1,10 @@
 import os
 import pandas as pd
 from datetime import datetime, timedelta
-from jinja2 import Template, Environment, FileSystemLoader
+from jinja2 import Template, Environment, FileSystemLoader, FileSystemBytecodeCache
 from typing import Dict, List, Optional
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 # Try to import WeasyPrint, but continue if not available
 try:
@@ -14,6 +15,11 @@ except ImportError:
     WEASYPRINT_AVAILABLE = False
     print("WeasyPrint not available - PDF generation disabled")
 
+def _write_pdf(html_content: str, output_path: str) -> str:
+    """Convert rendered HTML to a PDF file (module-level so it can run in a worker process)"""
+    HTML(string=html_content).write_pdf(output_path, font_config=FontConfiguration())
+    return output_path
+
 class ReportGenerator:
     """Generate HTML and PDF reports from audit results"""
     
@@ -22,20 +28,28 @@ class ReportGenerator:
             template_dir = os.path.join(os.path.dirname(__file__), '..', 'templates')
         
         self.template_dir = template_dir
-        self.env = Environment(loader=FileSystemLoader(template_dir))
+        # Templates are static at runtime - skip mtime checks and reuse compiled bytecode across processes
+        self.env = Environment(
+            loader=FileSystemLoader(template_dir),
+            auto_reload=False,
+            bytecode_cache=FileSystemBytecodeCache()
+        )
+        
+        # Parse the report template and initialize fonts once, reused for every report
+        self._template = self.env.get_template('report.html')
+        self._font_config = FontConfiguration() if WEASYPRINT_AVAILABLE else None
     
     def generate_html_report(self, audit_results: Dict, summary_stats: Dict, 
                            company_name: str = "Fleet Company", 
-                           start_date: str = None, end_date: str = None) -> str:
-        """Generate HTML report from audit results"""
+                           start_date: str = None, end_date: str = None,
+                           chunk_size: int = 500) -> str:
+        """Generate HTML report from audit results (violation lists are split every chunk_size items)"""
         
         # Set default date range if not provided
         if start_date is None or end_date is None:
             end_date = datetime.now().strftime('%Y-%m-%d')
             start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
         
-        template = self.env.get_template('report.html')
-        
         # Prepare context for template
         context = {
             'company_name': company_name,
@@ -43,63 +57,111 @@ class ReportGenerator:
             'end_date': end_date,
             'generated_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'violations': audit_results,
-            'summary_stats': summary_stats
+            'summary_stats': summary_stats,
+            'chunk_size': chunk_size
         }
         
-        return template.render(context)
+        return self._template.render(context)
     
     def generate_pdf_report(self, audit_results: Dict, summary_stats: Dict,
                            company_name: str = "Fleet Company",
                            start_date: str = None, end_date: str = None,
-                           output_path: str = None) -> str:
+                           output_path: str = None, chunk_size: int = 500) -> str:
         """Generate PDF report from audit results"""
         
         # Generate HTML first
         html_content = self.generate_html_report(
-            audit_results, summary_stats, company_name, start_date, end_date
+            audit_results, summary_stats, company_name, start_date, end_date, chunk_size
         )
         
-        # Set output path
-        if output_path is None:
-            reports_dir = os.path.join(os.path.dirname(__file__), '..', 'reports')
-            os.makedirs(reports_dir, exist_ok=True)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            
         if not WEASYPRINT_AVAILABLE:
             # Fallback: save as HTML if WeasyPrint not available
-            html_output_path = output_path.replace('.pdf', '.html') if output_path else os.path.join(reports_dir, f'fleet_audit_report_{timestamp}.html')
+            html_output_path = output_path.replace('.pdf', '.html') if output_path else self._default_output_path('html')
             with open(html_output_path, 'w', encoding='utf-8') as f:
                 f.write(html_content)
             return html_output_path
         
         if output_path is None:
-            output_path = os.path.join(reports_dir, f'fleet_audit_report_{timestamp}.pdf')
+            output_path = self._default_output_path('pdf')
         
         # Convert HTML to PDF
         try:
-            font_config = FontConfiguration()
-            html_doc = HTML(string=html_content)
-            html_doc.write_pdf(output_path, font_config=font_config)
-            return output_path
+            return self._html_to_pdf(html_content, output_path)
         except Exception as e:
-            # Fallback: save as HTML if PDF generation fails
-            html_output_path = output_path.replace('.pdf', '.html')
-            with open(html_output_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            raise Exception(f"PDF generation failed: {str(e)}. HTML saved to {html_output_path}")
+            raise self._pdf_failure(html_content, output_path, e) from e
+    
+    def generate_pdf_reports_bulk(self, jobs: List[Dict], max_workers: int = None) -> List[str]:
+        """
+        Generate several PDF reports, laying out the PDFs in parallel worker processes
+        
+        Each job is a dict of generate_pdf_report keyword arguments
+        """
+        if not WEASYPRINT_AVAILABLE or len(jobs) < 2:
+            return [self.generate_pdf_report(**job) for job in jobs]
+        
+        # Render HTML here with the compiled template; only the CPU-heavy PDF layout is fanned out
+        rendered = []
+        for index, job in enumerate(jobs):
+            html_content = self.generate_html_report(
+                job['audit_results'], job['summary_stats'],
+                job.get('company_name', "Fleet Company"),
+                job.get('start_date'), job.get('end_date'), job.get('chunk_size', 500)
+            )
+            output_path = job.get('output_path') or self._default_output_path('pdf', suffix=f'_{index + 1}')
+            rendered.append((html_content, output_path))
+        
+        output_paths = []
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_write_pdf, html_content, output_path) for html_content, output_path in rendered]
+            
+            for (html_content, output_path), future in zip(rendered, futures):
+                try:
+                    output_paths.append(future.result())
+                except Exception as e:
+                    raise self._pdf_failure(html_content, output_path, e) from e
+        
+        return output_paths
+    
+    def _html_to_pdf(self, html_content: str, output_path: str) -> str:
+        """Convert rendered HTML to a PDF file using the shared font configuration"""
+        HTML(string=html_content).write_pdf(output_path, font_config=self._font_config)
+        return output_path
+    
+    def _default_output_path(self, extension: str, suffix: str = '') -> str:
+        """Build a timestamped report path in the reports directory"""
+        reports_dir = os.path.join(os.path.dirname(__file__), '..', 'reports')
+        os.makedirs(reports_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return os.path.join(reports_dir, f'fleet_audit_report_{timestamp}{suffix}.{extension}')
+    
+    def _pdf_failure(self, html_content: str, output_path: str, error: Exception) -> Exception:
+        """Save the HTML next to the intended PDF and return the error to raise, naming its location"""
+        # Fallback: save as HTML if PDF generation fails
+        html_output_path = output_path.replace('.pdf', '.html')
+        with open(html_output_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        return Exception(f"PDF generation failed: {str(error)}. HTML saved to {html_output_path}")
     
-    def create_weekly_report(self, auditor, company_name: str = "Fleet Company") -> str:
+    def create_weekly_report(self, auditor, company_name: str = "Fleet Company",
+                             chunk_size: int = 500) -> str:
         """Create a complete weekly report from FleetAuditor results"""
         
+        # Run the audit once and reuse its results
+        audit_results = auditor.run_full_audit()
+        
         if not auditor.violations:
-            raise ValueError("No audit results available. Run audit first.")
+            # Nothing to lay out - save the short "no violations" report as HTML and skip PDF rendering
+            empty_summary = {'total_violations': 0, 'violations_by_type': {}, 'vehicles_with_violations': 0}
+            html_content = self.generate_html_report({}, empty_summary, company_name)
+            html_output_path = self._default_output_path('html')
+            with open(html_output_path, 'w', encoding='utf-8') as f:
+                f.write(html_content)
+            return html_output_path
         
-        # Get audit results and summary
-        audit_results = auditor.run_full_audit()
         summary_stats = auditor.get_summary_stats()
         
         # Generate PDF
-        return self.generate_pdf_report(audit_results, summary_stats, company_name)
+        return self.generate_pdf_report(audit_results, summary_stats, company_name, chunk_size=chunk_size)
     
     def preview_report_html(self, audit_results: Dict, summary_stats: Dict,
                            company_name: str = "Fleet Company") -> str:
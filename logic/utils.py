@@ -1,20 +1,82 @@
+import math
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
-from haversine import haversine, Unit
 from typing import Tuple, List, Dict, Optional
 
+# Try to import Numba, but fall back to NumPy if not available
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Mean earth radius in miles (6371.0088 km, the IUGG mean radius)
+EARTH_RADIUS_MILES = 6371.0088 / 1.609344
+
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate distance between two coordinates in miles using haversine formula"""
     if pd.isna(lat1) or pd.isna(lon1) or pd.isna(lat2) or pd.isna(lon2):
         return float('inf')
     
-    point1 = (lat1, lon1)
-    point2 = (lat2, lon2)
-    return haversine(point1, point2, unit=Unit.MILES)
+    # Scalar math beats tuple packing and unit dispatch for a single pair of points
+    lat1 = math.radians(lat1)
+    lat2 = math.radians(lat2)
+    dlat = lat2 - lat1
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+def calculate_distance_array(lat1: np.ndarray, lon1: np.ndarray,
+                             lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Vectorized haversine distance in miles between arrays of coordinates (NaN where any input is NaN)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
+
+if NUMBA_AVAILABLE:
+    # No 'nnan' fast-math flag: the NaN checks below must survive optimization
+    @njit(cache=True, fastmath={'reassoc', 'contract', 'arcp'})
+    def _cumulative_haversine(lats: np.ndarray, lons: np.ndarray) -> float:
+        """Sum haversine distances between consecutive points in a single compiled pass"""
+        total = 0.0
+        for i in range(len(lats) - 1):
+            lat1, lon1, lat2, lon2 = lats[i], lons[i], lats[i + 1], lons[i + 1]
+            if np.isnan(lat1) or np.isnan(lon1) or np.isnan(lat2) or np.isnan(lon2):
+                continue
+            
+            lat1 = math.radians(lat1)
+            lat2 = math.radians(lat2)
+            dlat = lat2 - lat1
+            dlon = math.radians(lon2 - lon1)
+            a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+            total += 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+        return total
+
+def cumulative_distance(lats: np.ndarray, lons: np.ndarray) -> float:
+    """Total distance in miles along a path of coordinates, skipping segments with missing points"""
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    lons = np.ascontiguousarray(lons, dtype=np.float64)
+    
+    if len(lats) < 2:
+        return 0.0
+    
+    if NUMBA_AVAILABLE:
+        return float(_cumulative_haversine(lats, lons))
+    
+    return float(np.nansum(calculate_distance_array(lats[:-1], lons[:-1], lats[1:], lons[1:])))
+
+def _is_missing(value) -> bool:
+    """Scalar missing-value check: None, pd.NA, or NaN/NaT (which never compare equal to themselves)"""
+    # pd.NA is tested by identity first - comparing it returns NA, which cannot be used as a bool
+    return value is None or value is pd.NA or value != value
 
 def is_within_time_window(timestamp1: datetime, timestamp2: datetime, window_minutes: int = 15) -> bool:
     """Check if two timestamps are within specified time window"""
-    if pd.isna(timestamp1) or pd.isna(timestamp2):
+    if _is_missing(timestamp1) or _is_missing(timestamp2):
         return False
     
     time_diff = abs((timestamp1 - timestamp2).total_seconds() / 60)
@@ -34,39 +96,137 @@ def geocode_address(address: str) -> Tuple[Optional[float], Optional[float]]:
 
 def is_business_hours(timestamp: datetime, start_hour: int = 7, end_hour: int = 18) -> bool:
     """Check if timestamp falls within business hours"""
-    if pd.isna(timestamp):
-        return False
-    
-    # Only check weekdays (Monday=0, Sunday=6)
-    if timestamp.weekday() >= 5:  # Weekend
-        return False
-    
-    hour = timestamp.hour
-    return start_hour <= hour <= end_hour
+    # Missing timestamps are never business hours; only weekdays count (Monday=0, Sunday=6)
+    return (not _is_missing(timestamp)
+            and timestamp.weekday() < 5 and start_hour <= timestamp.hour <= end_hour)
+
+def _naive_datetimes(timestamps: pd.Series) -> np.ndarray:
+    """datetime64 values of a timestamp column - tz-aware columns are converted to naive UTC first"""
+    if isinstance(timestamps.dtype, pd.DatetimeTZDtype):
+        timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+    return timestamps.to_numpy()
+
+def _datetime_ticks(timestamps: np.ndarray) -> Tuple[np.ndarray, int]:
+    """View datetime64 values as int64 ticks, along with the number of ticks per minute in their unit"""
+    ticks_per_minute = int(np.timedelta64(1, 'm') // np.timedelta64(1, np.datetime_data(timestamps.dtype)[0]))
+    return timestamps.view(np.int64), ticks_per_minute
 
 def find_gps_near_location(gps_df: pd.DataFrame, lat: float, lon: float, 
                           timestamp: datetime, distance_miles: float = 1.0, 
                           time_window_minutes: int = 15) -> pd.DataFrame:
     """Find GPS records near a specific location and time"""
-    if lat is None or lon is None:
+    if lat is None or lon is None or pd.isna(timestamp):
         return pd.DataFrame()
     
-    # Filter by time window first (more efficient)
-    time_mask = gps_df['timestamp'].apply(
-        lambda t: is_within_time_window(t, timestamp, time_window_minutes)
-    )
-    time_filtered = gps_df[time_mask]
+    # Filter by time window first (more efficient), comparing integer ticks;
+    # missing timestamps are the minimum int64 tick and fall below the window
+    gps_times = _naive_datetimes(gps_df['timestamp'])
+    ticks, ticks_per_minute = _datetime_ticks(gps_times)
+    center = pd.Timestamp(timestamp)
+    gps_tz = getattr(gps_df['timestamp'].dtype, 'tz', None)
+    if gps_tz is not None:
+        # Ticks of a tz-aware column are UTC; a naive timestamp is taken to be in the column's zone
+        center = (center.tz_localize(gps_tz) if center.tz is None else center).tz_convert('UTC').tz_localize(None)
+    center = center.to_datetime64().astype(gps_times.dtype).astype(np.int64)
+    # Integer bounds: at nanosecond resolution a float window would lose precision
+    window = int(time_window_minutes * ticks_per_minute)
+    time_filtered = gps_df[(ticks >= center - window) & (ticks <= center + window)]
     
     if time_filtered.empty:
         return pd.DataFrame()
     
-    # Then filter by distance
-    distance_mask = time_filtered.apply(
-        lambda row: is_within_distance(row['lat'], row['lon'], lat, lon, distance_miles),
-        axis=1
+    # Then filter by distance; missing coordinates yield NaN distances and drop out
+    distances = calculate_distance_array(
+        time_filtered['lat'].to_numpy(dtype=float), time_filtered['lon'].to_numpy(dtype=float), lat, lon
     )
     
-    return time_filtered[distance_mask]
+    return time_filtered[distances <= distance_miles]
+
+def _segment_means(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Mean of each [start, end) segment given interleaved run edges, ignoring NaN values"""
+    valid = ~np.isnan(values)
+    
+    # Pad so a run ending at the last row still has a valid reduceat index
+    sums = np.add.reduceat(np.append(np.where(valid, values, 0.0), 0.0), edges)[::2]
+    counts = np.add.reduceat(np.append(valid, False).astype(np.int64), edges)[::2]
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _find_idle_runs_jit(speeds: np.ndarray, ticks: np.ndarray, valid_count: int,
+                            lats: np.ndarray, lons: np.ndarray,
+                            max_speed: float, min_duration: float):
+        """Find long idle runs and their mean location in a single streaming pass"""
+        n = len(speeds)
+        max_runs = n // 2 + 1
+        starts = np.empty(max_runs, dtype=np.int64)
+        last_rows = np.empty(max_runs, dtype=np.int64)
+        lat_means = np.empty(max_runs, dtype=np.float64)
+        lon_means = np.empty(max_runs, dtype=np.float64)
+        
+        found = 0
+        i = 0
+        while i < n:
+            if not speeds[i] <= max_speed:
+                i += 1
+                continue
+            
+            run_start = i
+            lat_sum = 0.0
+            lon_sum = 0.0
+            lat_count = 0
+            lon_count = 0
+            while i < n and speeds[i] <= max_speed:
+                if not np.isnan(lats[i]):
+                    lat_sum += lats[i]
+                    lat_count += 1
+                if not np.isnan(lons[i]):
+                    lon_sum += lons[i]
+                    lon_count += 1
+                i += 1
+            
+            # Missing timestamps sit at the tail, so a run's latest valid time is its last row before them
+            last_row = min(i, valid_count) - 1
+            if last_row >= run_start and ticks[last_row] - ticks[run_start] >= min_duration:
+                starts[found] = run_start
+                last_rows[found] = last_row
+                lat_means[found] = lat_sum / lat_count if lat_count > 0 else np.nan
+                lon_means[found] = lon_sum / lon_count if lon_count > 0 else np.nan
+                found += 1
+        
+        return starts[:found], last_rows[:found], lat_means[:found], lon_means[:found]
+
+def _find_idle_runs(speeds: np.ndarray, timestamps: np.ndarray, lats: np.ndarray, lons: np.ndarray,
+                    max_speed: float, min_minutes: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find idle runs lasting at least min_minutes in time-sorted GPS arrays (missing timestamps last)
+    
+    Returns the first row, last timestamped row, mean latitude and mean longitude of each run
+    """
+    valid_count = np.count_nonzero(~np.isnat(timestamps))
+    ticks, ticks_per_minute = _datetime_ticks(timestamps)
+    
+    if NUMBA_AVAILABLE:
+        # Compare raw datetime ticks against the minimum duration expressed in the same unit
+        return _find_idle_runs_jit(
+            speeds, ticks, valid_count, lats, lons,
+            float(max_speed), float(min_minutes * ticks_per_minute)
+        )
+    
+    # Run-length encode consecutive idle rows: edges alternate run start / run end (exclusive)
+    is_idle = speeds <= max_speed
+    edges = np.flatnonzero(np.diff(np.r_[False, is_idle, False]))
+    
+    starts = edges[::2]
+    last_rows = np.minimum(edges[1::2], valid_count) - 1
+    has_time = last_rows >= starts
+    
+    durations = (ticks[np.maximum(last_rows, starts)] - ticks[starts]) / ticks_per_minute
+    keep = has_time & (durations >= min_minutes)
+    
+    return starts[keep], last_rows[keep], _segment_means(lats, edges)[keep], _segment_means(lons, edges)[keep]
 
 def detect_idle_periods(gps_df: pd.DataFrame, min_idle_minutes: int = 10, 
                        max_speed_mph: float = 3) -> List[Dict]:
@@ -78,32 +238,34 @@ def detect_idle_periods(gps_df: pd.DataFrame, min_idle_minutes: int = 10,
         if vehicle_data.empty:
             continue
             
-        # Sort by timestamp
+        # Sort by timestamp (missing timestamps sort last)
         vehicle_data = vehicle_data.sort_values('timestamp')
         
-        # Find consecutive low-speed periods
-        is_idle = vehicle_data['speed_mph'] <= max_speed_mph
+        # Run detection works on naive (UTC) ticks; reported times come from the column and keep its zone
+        timestamps = _naive_datetimes(vehicle_data['timestamp'])
+        starts, last_rows, lat_means, lon_means = _find_idle_runs(
+            vehicle_data['speed_mph'].to_numpy(dtype=float, na_value=np.nan),
+            timestamps,
+            vehicle_data['lat'].to_numpy(dtype=float, na_value=np.nan),
+            vehicle_data['lon'].to_numpy(dtype=float, na_value=np.nan),
+            max_speed_mph, min_idle_minutes
+        )
         
-        # Group consecutive idle periods
-        idle_groups = (is_idle != is_idle.shift()).cumsum()
+        start_times = vehicle_data['timestamp'].iloc[starts]
+        end_times = vehicle_data['timestamp'].iloc[last_rows]
+        ticks, ticks_per_minute = _datetime_ticks(timestamps)
+        durations = (ticks[last_rows] - ticks[starts]) / ticks_per_minute
         
-        for group_id, group_data in vehicle_data.groupby(idle_groups):
-            if group_data['speed_mph'].iloc[0] <= max_speed_mph:
-                # Calculate idle duration
-                start_time = group_data['timestamp'].min()
-                end_time = group_data['timestamp'].max()
-                duration_minutes = (end_time - start_time).total_seconds() / 60
-                
-                if duration_minutes >= min_idle_minutes:
-                    idle_periods.append({
-                        'vehicle_id': vehicle_id,
-                        'start_time': start_time,
-                        'end_time': end_time,
-                        'duration_minutes': duration_minutes,
-                        'location_lat': group_data['lat'].mean(),
-                        'location_lon': group_data['lon'].mean(),
-                        'violation_type': 'idle_abuse'
-                    })
+        for i in range(len(starts)):
+            idle_periods.append({
+                'vehicle_id': vehicle_id,
+                'start_time': start_times.iloc[i],
+                'end_time': end_times.iloc[i],
+                'duration_minutes': float(durations[i]),
+                'location_lat': lat_means[i],
+                'location_lon': lon_means[i],
+                'violation_type': 'idle_abuse'
+            })
     
     return idle_periods
 
@@ -123,24 +285,25 @@ def filter_business_hours_violations(gps_df: pd.DataFrame,
     
     # Filter for non-business hours activity (only for timestamps with time data)
     gps_with_time = gps_df[timestamps_with_time]
-    after_hours = gps_with_time[~gps_with_time['timestamp'].apply(
-        lambda t: is_business_hours(t, start_hour, end_hour)
-    )]
+    timestamps = gps_with_time['timestamp'].dt
+    in_business_hours = (timestamps.weekday < 5) & timestamps.hour.between(start_hour, end_hour)
+    after_hours = gps_with_time[~in_business_hours]
     
-    # Group by vehicle and create violations
-    for vehicle_id, vehicle_data in after_hours.groupby('vehicle_id'):
-        if vehicle_data.empty:
-            continue
-        
-        # Group by date to avoid duplicate violations for same day
-        for date, daily_data in vehicle_data.groupby(vehicle_data['timestamp'].dt.date):
-            violations.append({
-                'vehicle_id': vehicle_id,
-                'date': date,
-                'first_violation_time': daily_data['timestamp'].min(),
-                'last_violation_time': daily_data['timestamp'].max(),
-                'total_records': len(daily_data),
-                'violation_type': 'after_hours_driving'
-            })
+    # Group by vehicle and date to avoid duplicate violations for same day
+    daily_activity = after_hours.groupby(
+        [after_hours['vehicle_id'], after_hours['timestamp'].dt.date]
+    )['timestamp'].agg(['min', 'max', 'size'])
+    
+    for (vehicle_id, date), first_time, last_time, total_records in zip(
+        daily_activity.index, daily_activity['min'], daily_activity['max'], daily_activity['size']
+    ):
+        violations.append({
+            'vehicle_id': vehicle_id,
+            'date': date,
+            'first_violation_time': first_time,
+            'last_violation_time': last_time,
+            'total_records': int(total_records),
+            'violation_type': 'after_hours_driving'
+        })
     
-    return violations
\ No newline at end of file
+    return violations
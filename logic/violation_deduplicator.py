@@ -1,11 +1,138 @@
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple
 from collections import defaultdict
 
+# Try to import Numba, but fall back to a pure Python sweep if not available
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Numeric severity for ranking (high > medium > low); unknown severities rank lowest
+_SEVERITY = {'low': 1, 'medium': 2, 'high': 3}
+_SEVERITY_NAMES = {score: severity for severity, score in _SEVERITY.items()}
+
+class _DisjointSet:
+    """Union-find over 0..size-1; each set's root is its smallest member"""
+    
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+    
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            # Path halving keeps later lookups short
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    def union(self, i: int, j: int):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _find_root(parents, i):
+        """Union-find root lookup with path halving"""
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+    
+    @njit(cache=True)
+    def _sweep_incidents_jit(vehicles, times, cluster_masks, locations, block_ends, window_ns):
+        """Compiled incident sweep over violations sorted by vehicle then time (see _sweep_incidents)"""
+        n = len(vehicles)
+        parents = np.arange(n)
+        
+        for p in range(n):
+            if vehicles[p] < 0:
+                continue
+            
+            window_end = times[p] + window_ns
+            for j in range(p + 1, block_ends[p]):
+                if times[j] > window_end:
+                    break
+                if (cluster_masks[p] & cluster_masks[j]) != 0 or (locations[p] >= 0 and locations[p] == locations[j]):
+                    root_p = _find_root(parents, p)
+                    root_j = _find_root(parents, j)
+                    if root_p != root_j:
+                        parents[max(root_p, root_j)] = min(root_p, root_j)
+        
+        roots = np.empty(n, dtype=np.int64)
+        for p in range(n):
+            roots[p] = _find_root(parents, p)
+        return roots
+
+def _sweep_incidents(vehicles: np.ndarray, times: np.ndarray, cluster_masks: np.ndarray,
+                     locations: np.ndarray, window_ns: int) -> np.ndarray:
+    """
+    Assign each violation an incident id, equal for all violations of the same incident
+    
+    Two violations are related when they belong to the same vehicle, lie within window_ns of each
+    other and share a cluster bit or a location code; incidents are the connected groups of related
+    violations. Vehicle code -1 marks violations that can't be matched (no vehicle or timestamp);
+    location code -1 means no location.
+    """
+    # Sort by vehicle then time (stable); each vehicle's violations form one contiguous block
+    order = np.lexsort((times, vehicles))
+    sorted_vehicles = vehicles[order]
+    sorted_times = times[order]
+    block_ends = np.searchsorted(sorted_vehicles, sorted_vehicles, side='right')
+    sorted_masks = cluster_masks[order]
+    sorted_locations = locations[order]
+    
+    if NUMBA_AVAILABLE:
+        roots = _sweep_incidents_jit(
+            sorted_vehicles, sorted_times, sorted_masks, sorted_locations, block_ends, window_ns
+        )
+    else:
+        sorted_vehicles, sorted_times, sorted_masks, sorted_locations, block_ends = (
+            array.tolist() for array in (sorted_vehicles, sorted_times, sorted_masks, sorted_locations, block_ends)
+        )
+        incidents = _DisjointSet(len(sorted_times))
+        
+        for p in range(len(sorted_times)):
+            if sorted_vehicles[p] < 0:
+                continue
+            
+            # Pair each violation with the later ones of its vehicle, stopping at the end of the time window
+            window_end = sorted_times[p] + window_ns
+            for j in range(p + 1, block_ends[p]):
+                if sorted_times[j] > window_end:
+                    break
+                if sorted_masks[p] & sorted_masks[j] or (sorted_locations[p] >= 0 and sorted_locations[p] == sorted_locations[j]):
+                    incidents.union(p, j)
+        
+        roots = np.array([incidents.find(p) for p in range(len(sorted_times))])
+    
+    incident_ids = np.empty(len(order), dtype=np.int64)
+    incident_ids[order] = roots
+    return incident_ids
+
 class ViolationDeduplicator:
     """Consolidate and deduplicate related violations for clean production reporting"""
     
+    # Readable names for detection methods in consolidated descriptions
+    _METHOD_NAMES = {
+        'volume_excess': 'Tank capacity exceeded',
+        'obvious_rapid_refill': 'Rapid refill pattern',
+        'price_excess': 'Excessive transaction cost',
+        'price_premium': 'Unusually high fuel price',
+        'pattern_deviation': 'Statistical pattern anomaly',
+        'daily_excess': 'Daily fuel consumption exceeded',
+        'fuel_dumping_mpg': 'Fuel dumping (MPG analysis)',
+        'odometer_fraud_mpg': 'Odometer manipulation suspected',
+        'excessive_consumption_mpg': 'Excessive fuel consumption',
+        'idle_refill_mpg': 'Idle refill detected',
+        'estimated_volume_excess': 'Estimated volume exceeded',
+        'extreme_amount_deviation': 'Extreme cost deviation'
+    }
+    
     def __init__(self):
         # Define which violations should be grouped together
         self.related_violations = {
@@ -35,6 +162,12 @@ class ViolationDeduplicator:
             ]
         }
         
+        # Reverse index: method -> clusters it belongs to (a method may sit in several)
+        self._method_clusters = {}
+        for cluster_name, methods in self.related_violations.items():
+            for method in methods:
+                self._method_clusters[method] = self._method_clusters.get(method, frozenset()) | {cluster_name}
+        
         # Time window for grouping violations (same incident)
         self.grouping_window_hours = 2
         self.grouping_distance_miles = 5  # Same location if within 5 miles
@@ -54,113 +187,96 @@ class ViolationDeduplicator:
         # Consolidate each group into a single incident
         consolidated_violations = []
         for group in violation_groups:
-            consolidated = self._consolidate_violation_group(group)
-            consolidated_violations.append(consolidated)
+            if len(group) == 1:
+                # Single violation - just add financial summary (as a new dict; the input is the caller's raw violation)
+                violation = group[0]
+                consolidated_violations.append({
+                    **violation,
+                    'total_estimated_loss': violation.get('estimated_loss', 0),
+                    'detection_methods': [violation.get('detection_method', 'unknown')],
+                    'evidence_count': 1
+                })
+            else:
+                consolidated_violations.append(self._consolidate_violation_group(group))
         
-        # Sort by severity and estimated loss
+        # Sort by severity (highest first), then by estimated loss
         consolidated_violations.sort(key=lambda x: (
-            self._severity_score(x['severity']),
-            -x.get('total_estimated_loss', 0)
-        ), reverse=True)
+            -_SEVERITY.get(x['severity'], 0),
+            x.get('total_estimated_loss', 0)
+        ))
         
         return consolidated_violations
     
     def _group_violations_by_incident(self, violations: List[Dict]) -> List[List[Dict]]:
         """Group violations that likely represent the same incident"""
         
-        # Create DataFrame for easier grouping
-        df = pd.DataFrame(violations)
-        
-        if df.empty:
+        if not violations:
             return []
         
-        grouped_violations = []
-        processed_indices = set()
-        
-        for i, violation in df.iterrows():
-            if i in processed_indices:
-                continue
-            
-            # Start a new group with this violation
-            current_group = [violation.to_dict()]
-            processed_indices.add(i)
-            
-            # Find related violations
-            for j, other_violation in df.iterrows():
-                if j in processed_indices or i == j:
-                    continue
-                
-                if self._are_violations_related(violation, other_violation):
-                    current_group.append(other_violation.to_dict())
-                    processed_indices.add(j)
-            
-            grouped_violations.append(current_group)
-        
-        return grouped_violations
-    
-    def _are_violations_related(self, v1: pd.Series, v2: pd.Series) -> bool:
-        """Determine if two violations are part of the same incident"""
-        
-        # Must be same vehicle
-        if v1['vehicle_id'] != v2['vehicle_id']:
-            return False
-        
-        # Must be within time window
-        time_diff = abs((pd.to_datetime(v1['timestamp']) - pd.to_datetime(v2['timestamp'])).total_seconds() / 3600)
-        if time_diff > self.grouping_window_hours:
-            return False
-        
-        # Check if violation types are related
-        method1 = v1.get('detection_method', '')
-        method2 = v2.get('detection_method', '')
+        window_ns = int(self.grouping_window_hours * 3600 * 1_000_000_000)
+        
+        # Parse every timestamp in one vectorized pass, as integer nanoseconds
+        parsed_times = pd.DatetimeIndex(pd.to_datetime(
+            pd.Series([violation.get('timestamp') for violation in violations], dtype=object),
+            errors='coerce', format='mixed'
+        )).as_unit('ns')
+        
+        # Vehicles as integer codes; violations without a vehicle or timestamp (-1) can't be matched
+        vehicle_codes, _ = pd.factorize(pd.Series([violation.get('vehicle_id') for violation in violations], dtype=object))
+        vehicle_codes = vehicle_codes.astype(np.int64)
+        vehicle_codes[parsed_times.isna()] = -1
+        
+        # Normalize locations once into integer codes (-1 = no location) so pairs compare ints, not strings
+        location_codes, _ = pd.factorize(pd.Series([
+            str(location).strip() if location is not None and location == location else None
+            for location in (violation.get('location') for violation in violations)
+        ], dtype=object))
+        
+        # Each method's clusters as a bitmask, so related methods are those sharing a bit
+        cluster_bits = {cluster_name: 1 << bit for bit, cluster_name in enumerate(self.related_violations)}
+        method_masks = {
+            method: sum(cluster_bits[cluster_name] for cluster_name in clusters)
+            for method, clusters in self._method_clusters.items()
+        }
+        cluster_masks = np.array(
+            [method_masks.get(violation.get('detection_method', ''), 0) for violation in violations], dtype=np.int64
+        )
         
-        for cluster_name, methods in self.related_violations.items():
-            if method1 in methods and method2 in methods:
-                return True
+        incident_ids = _sweep_incidents(
+            vehicle_codes, parsed_times.asi8, cluster_masks, location_codes.astype(np.int64), window_ns
+        )
         
-        # Check location proximity (if location data available)
-        if 'location' in v1 and 'location' in v2:
-            if pd.notna(v1['location']) and pd.notna(v2['location']):
-                # Simple string comparison - in production could use geocoding
-                if str(v1['location']).strip() == str(v2['location']).strip():
-                    return True
+        # Collect incidents in the order their first violation was reported, members in reported order
+        incidents = defaultdict(list)
+        for violation, incident_id in zip(violations, incident_ids.tolist()):
+            incidents[incident_id].append(violation)
         
-        return False
+        return list(incidents.values())
     
     def _consolidate_violation_group(self, violation_group: List[Dict]) -> Dict:
         """Combine multiple related violations into a single consolidated incident"""
         
-        if len(violation_group) == 1:
-            # Single violation - just add financial summary
-            violation = violation_group[0].copy()
-            violation['total_estimated_loss'] = violation.get('estimated_loss', 0)
-            violation['detection_methods'] = [violation.get('detection_method', 'unknown')]
-            violation['evidence_count'] = 1
-            return violation
+        primary_violation = violation_group[0]  # Use first as base (read-only until copied below)
         
-        # Multiple violations - consolidate
-        primary_violation = violation_group[0].copy()  # Use first as base
-        
-        # Aggregate detection methods
-        detection_methods = []
+        # Aggregate detection methods (insertion-ordered dict keeps first-seen order with O(1) dedup)
+        detection_methods = {}
         total_loss = 0
         max_confidence = 0
-        max_severity = 'low'
+        max_severity_score = _SEVERITY['low']
         
         evidence_details = []
         
         for violation in violation_group:
             method = violation.get('detection_method', 'unknown')
-            if method not in detection_methods:
-                detection_methods.append(method)
+            detection_methods[method] = None
             
             total_loss += violation.get('estimated_loss', 0)
             max_confidence = max(max_confidence, violation.get('confidence', 0))
             
-            # Track severity (high > medium > low)
-            current_severity = violation.get('severity', 'low')
-            if self._severity_score(current_severity) > self._severity_score(max_severity):
-                max_severity = current_severity
+            # Track severity (high > medium > low) as a score, translated back to a name at the end
+            severity_score = _SEVERITY.get(violation.get('severity', 'low'), 0)
+            if severity_score > max_severity_score:
+                max_severity_score = severity_score
             
             # Collect evidence details
             evidence_details.append({
@@ -170,13 +286,15 @@ class ViolationDeduplicator:
                 'loss': violation.get('estimated_loss', 0)
             })
         
+        detection_methods = list(detection_methods)
+        
         # Create consolidated description
         consolidated_description = self._create_consolidated_description(
-            primary_violation, detection_methods, evidence_details
+            primary_violation, detection_methods, evidence_details, total_loss
         )
         
         # Create consolidated violation
-        consolidated = primary_violation.copy()
+        consolidated = dict(primary_violation)
         consolidated.update({
             'detection_method': 'multi_factor_analysis',
             'detection_methods': detection_methods,
@@ -185,7 +303,7 @@ class ViolationDeduplicator:
             'evidence_details': evidence_details,
             'total_estimated_loss': total_loss,
             'confidence': min(max_confidence + 0.1, 0.99),  # Boost confidence for multiple evidence
-            'severity': max_severity,
+            'severity': _SEVERITY_NAMES[max_severity_score],
             'consolidated': True
         })
         
@@ -193,7 +311,7 @@ class ViolationDeduplicator:
     
     def _create_consolidated_description(self, primary_violation: Dict, 
                                        detection_methods: List[str], 
-                                       evidence_details: List[Dict]) -> str:
+                                       evidence_details: List[Dict], total_loss: float) -> str:
         """Create a comprehensive description for consolidated violations"""
         
         vehicle_id = primary_violation['vehicle_id']
@@ -201,21 +319,27 @@ class ViolationDeduplicator:
         location = primary_violation.get('location', 'Unknown location')
         
         # Group methods by type
-        fuel_theft_methods = []
-        mpg_methods = []
-        other_methods = []
+        fuel_theft_methods = set()
+        mpg_methods = set()
         
         for method in detection_methods:
-            if any(method in cluster for cluster in [
-                self.related_violations['fuel_theft_cluster'],
-                self.related_violations['mpg_fraud_cluster']
-            ]):
+            if not self._method_clusters.get(method, frozenset()).isdisjoint(('fuel_theft_cluster', 'mpg_fraud_cluster')):
                 if 'mpg' in method:
-                    mpg_methods.append(method)
+                    mpg_methods.add(method)
                 else:
-                    fuel_theft_methods.append(method)
-            else:
-                other_methods.append(method)
+                    fuel_theft_methods.add(method)
+        
+        # Readable name for each method, formatted once per group
+        method_names = {method: self._format_method_name(method) for method in detection_methods}
+        
+        # Partition evidence by method type in a single pass
+        fuel_evidence = []
+        mpg_evidence = []
+        for evidence in evidence_details:
+            if evidence['method'] in fuel_theft_methods:
+                fuel_evidence.append(evidence)
+            elif evidence['method'] in mpg_methods:
+                mpg_evidence.append(evidence)
         
         # Build description
         description_parts = []
@@ -231,19 +355,16 @@ class ViolationDeduplicator:
         
         # Add evidence summary
         if fuel_theft_methods:
-            fuel_evidence = [d for d in evidence_details if d['method'] in fuel_theft_methods]
             description_parts.append(f"Fuel theft evidence ({len(fuel_evidence)} indicators):")
             for evidence in fuel_evidence[:3]:  # Show top 3
-                description_parts.append(f"• {self._format_method_name(evidence['method'])}")
+                description_parts.append(f"• {method_names[evidence['method']]}")
         
         if mpg_methods:
-            mpg_evidence = [d for d in evidence_details if d['method'] in mpg_methods]
             description_parts.append(f"MPG analysis evidence ({len(mpg_evidence)} indicators):")
             for evidence in mpg_evidence[:3]:
-                description_parts.append(f"• {self._format_method_name(evidence['method'])}")
+                description_parts.append(f"• {method_names[evidence['method']]}")
         
         # Add financial impact
-        total_loss = sum(d['loss'] for d in evidence_details)
         if total_loss > 0:
             description_parts.append(f"**Estimated financial impact: ${total_loss:.2f}**")
         
@@ -252,27 +373,7 @@ class ViolationDeduplicator:
     def _format_method_name(self, method: str) -> str:
         """Convert method names to readable format"""
         
-        method_names = {
-            'volume_excess': 'Tank capacity exceeded',
-            'obvious_rapid_refill': 'Rapid refill pattern',
-            'price_excess': 'Excessive transaction cost',
-            'price_premium': 'Unusually high fuel price',
-            'pattern_deviation': 'Statistical pattern anomaly',
-            'daily_excess': 'Daily fuel consumption exceeded',
-            'fuel_dumping_mpg': 'Fuel dumping (MPG analysis)',
-            'odometer_fraud_mpg': 'Odometer manipulation suspected',
-            'excessive_consumption_mpg': 'Excessive fuel consumption',
-            'idle_refill_mpg': 'Idle refill detected',
-            'estimated_volume_excess': 'Estimated volume exceeded',
-            'extreme_amount_deviation': 'Extreme cost deviation'
-        }
-        
-        return method_names.get(method, method.replace('_', ' ').title())
-    
-    def _severity_score(self, severity: str) -> int:
-        """Convert severity to numeric score for sorting"""
-        scores = {'low': 1, 'medium': 2, 'high': 3}
-        return scores.get(severity, 0)
+        return self._METHOD_NAMES.get(method) or method.replace('_', ' ').title()
     
     def generate_financial_summary(self, consolidated_violations: List[Dict], 
                                  time_period_days: int = 7) -> Dict:
@@ -281,48 +382,42 @@ class ViolationDeduplicator:
         if not consolidated_violations:
             return {}
         
-        # Calculate by vehicle
-        vehicle_losses = defaultdict(lambda: {
-            'total_loss': 0,
-            'violation_count': 0,
-            'highest_single_incident': 0,
-            'violation_types': set()
+        # Calculate by vehicle in a single groupby
+        violations_df = pd.DataFrame({
+            'vehicle_id': [violation['vehicle_id'] for violation in consolidated_violations],
+            'loss': [violation.get('total_estimated_loss', 0) for violation in consolidated_violations],
+            'methods': [violation.get('detection_methods', ()) for violation in consolidated_violations]
         })
+        by_vehicle = violations_df.groupby('vehicle_id', sort=False, dropna=False)
+        vehicle_losses = by_vehicle['loss'].agg(['sum', 'max', 'count'])
+        vehicle_methods = by_vehicle['methods'].agg(lambda methods: set().union(*methods))
         
-        total_fleet_loss = 0
-        
-        for violation in consolidated_violations:
-            vehicle_id = violation['vehicle_id']
-            loss = violation.get('total_estimated_loss', 0)
-            
-            vehicle_losses[vehicle_id]['total_loss'] += loss
-            vehicle_losses[vehicle_id]['violation_count'] += 1
-            vehicle_losses[vehicle_id]['highest_single_incident'] = max(
-                vehicle_losses[vehicle_id]['highest_single_incident'], loss
-            )
-            
-            # Track violation types
-            if 'detection_methods' in violation:
-                for method in violation['detection_methods']:
-                    vehicle_losses[vehicle_id]['violation_types'].add(method)
-            
-            total_fleet_loss += loss
+        total_fleet_loss = float(violations_df['loss'].sum())
         
-        # Format vehicle summaries
+        # Format vehicle summaries, tracking the vehicle with the highest loss as we go
         vehicle_summaries = {}
-        for vehicle_id, data in vehicle_losses.items():
-            weekly_loss = data['total_loss'] * (7 / time_period_days) if time_period_days > 0 else 0
-            monthly_loss = data['total_loss'] * (30 / time_period_days) if time_period_days > 0 else 0
+        worst_offender = None
+        worst_loss = None
+        for vehicle_id, total_loss, highest_loss, violation_count, violation_types in zip(
+            vehicle_losses.index, vehicle_losses['sum'], vehicle_losses['max'], vehicle_losses['count'], vehicle_methods
+        ):
+            total_loss = float(total_loss)
+            weekly_loss = total_loss * (7 / time_period_days) if time_period_days > 0 else 0
+            monthly_loss = total_loss * (30 / time_period_days) if time_period_days > 0 else 0
             
             vehicle_summaries[vehicle_id] = {
-                'total_loss': data['total_loss'],
+                'total_loss': total_loss,
                 'weekly_estimate': weekly_loss,
                 'monthly_estimate': monthly_loss,
-                'violation_count': data['violation_count'],
-                'highest_single_incident': data['highest_single_incident'],
-                'violation_methods': list(data['violation_types']),
-                'summary_text': f"Vehicle {vehicle_id} flagged for ${data['total_loss']:.2f} of likely stolen fuel this period"
+                'violation_count': int(violation_count),
+                'highest_single_incident': max(float(highest_loss), 0),
+                'violation_methods': list(violation_types),
+                'summary_text': f"Vehicle {vehicle_id} flagged for ${total_loss:.2f} of likely stolen fuel this period"
             }
+            
+            if worst_offender is None or total_loss > worst_loss:
+                worst_offender = vehicle_id
+                worst_loss = total_loss
         
         # Overall fleet summary
         summary = {
@@ -330,10 +425,9 @@ class ViolationDeduplicator:
             'weekly_fleet_estimate': total_fleet_loss * (7 / time_period_days) if time_period_days > 0 else 0,
             'monthly_fleet_estimate': total_fleet_loss * (30 / time_period_days) if time_period_days > 0 else 0,
             'total_violations': len(consolidated_violations),
-            'vehicles_flagged': len(vehicle_losses),
+            'vehicles_flagged': len(vehicle_summaries),
             'vehicle_summaries': vehicle_summaries,
-            'worst_offender': max(vehicle_summaries.keys(), 
-                                key=lambda v: vehicle_summaries[v]['total_loss']) if vehicle_summaries else None
+            'worst_offender': worst_offender
         }
         
         return summary
\ No newline at end of file
@@ -1,18 +1,129 @@
 import pandas as pd
 import json
 import io
-from typing import Dict, List, Optional
+import csv
+import hashlib
+import itertools
+import re
+import tempfile
+import threading
+from contextlib import suppress
+from typing import Dict, List, Optional, Tuple
 from anthropic import Anthropic
 import os
 from datetime import datetime
 
+# PyArrow's multithreaded CSV reader is much faster on large exports - optional, falls back to the C engine
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Typo-tolerant header matching (one-edit Levenshtein) - optional, exact keyword matching works without it
+try:
+    from rapidfuzz.distance import Levenshtein
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
+# Column mappings for CSV layouts already seen (vendor templates + past AI results), keyed by header fingerprint
+HEADER_MAPPING_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'header_mapping_cache.json')
+# Streamlit sessions are threads of one process - serializes the read-merge-write of the cache file
+_HEADER_MAPPING_LOCK = threading.Lock()
+
+# Arrow-backed strings make the vectorized .str cleanup much cheaper than object columns
+STRING_DTYPE = 'string[pyarrow]' if PYARROW_AVAILABLE else 'string'
+
 class AICsvNormalizer:
     """AI-powered CSV normalizer that converts any fuel CSV to consistent schema"""
     
+    # Static mapping instructions sent as a cached system block - must stay byte-identical across calls
+    MAPPING_PROMPT = """You are a CSV analysis expert. Analyze the fuel card transaction CSV sample and map the columns to our target schema.
+
+TARGET SCHEMA (what we need):
+- timestamp: transaction date and time 
+- location: gas station/merchant name
+- gallons: fuel quantity in gallons
+- vehicle_id: vehicle identifier/unit number
+- amount: cost in dollars (optional)
+
+INSTRUCTIONS:
+1. Identify which CSV columns map to each target schema field
+2. If date and time are separate columns, note both
+3. Handle various formats (WEX, Fleetcor, Fuelman, etc.)
+4. If a target field is missing, mark as null
+5. Consider column name variations and synonyms
+
+Return ONLY a JSON object with this exact format:
+{
+    "timestamp": "Column Name" or {"date_col": "Date Column", "time_col": "Time Column"} or null,
+    "location": "Column Name" or null,
+    "gallons": "Column Name" or null, 
+    "vehicle_id": "Column Name" or null,
+    "amount": "Column Name" or null
+}"""
+    
+    # Common fuel card export timestamp layouts (WEX, Fleetcor, Fuelman), month-first like pandas' default
+    DATETIME_FORMATS = (
+        '%m/%d/%Y %H:%M:%S',
+        '%m/%d/%Y %H:%M',
+        '%m/%d/%Y %I:%M:%S %p',
+        '%m/%d/%Y %I:%M %p',
+        '%Y-%m-%d %H:%M:%S',
+        '%Y-%m-%d %H:%M',
+        '%Y-%m-%dT%H:%M:%S',
+        '%m/%d/%Y',
+        '%Y-%m-%d',
+    )
+    
+    # Header words that identify each target field and how strongly (a Card column is only
+    # used for vehicle_id when nothing better exists)
+    COLUMN_KEYWORDS = {
+        'location': {'location': 100, 'merchant': 100, 'station': 100, 'site': 100, 'store': 90,
+                     'vendor': 90, 'retailer': 90, 'address': 70, 'city': 60},
+        'gallons': {'gallons': 100, 'gallon': 100, 'gals': 100, 'gal': 100, 'gl': 90, 'quantity': 95,
+                    'qty': 95, 'volume': 95, 'liters': 90, 'litres': 90, 'liter': 90},
+        'vehicle_id': {'vehicle': 100, 'unit': 95, 'truck': 95, 'van': 90, 'asset': 90,
+                       'equipment': 85, 'fleet': 70, 'card': 60},
+        'amount': {'amount': 100, 'total': 95, 'cost': 95, 'charge': 90, 'price': 70},
+    }
+    
+    # Words that rule a column out for a field ("Price Per Gallon" is neither gallons nor the total)
+    COLUMN_EXCLUSIONS = {
+        'location': frozenset({'zip', 'state', 'lat', 'latitude', 'lon', 'longitude'}),
+        'gallons': frozenset({'price', 'cost', 'amount', 'per', 'rate'}),
+        'vehicle_id': frozenset({'price', 'cost', 'amount', 'per', 'rate', 'gallon', 'gallons', 'qty', 'quantity', 'volume'}),
+        'amount': frozenset({'per', 'gallon', 'gallons', 'gal', 'gals', 'qty', 'quantity', 'volume', 'liters', 'litres', 'tax'}),
+    }
+    
+    DATE_KEYWORDS = {'date': 100, 'day': 80}
+    TIME_KEYWORDS = {'time': 100, 'hour': 80}
+    TIMESTAMP_WORDS = frozenset({'timestamp', 'datetime'})
+    PREFERRED_DATE_WORDS = frozenset({'transaction', 'trans', 'txn', 'purchase', 'fuel'})
+    SECONDARY_DATE_WORDS = frozenset({'post', 'posted', 'posting', 'settlement', 'settled', 'invoice', 'bill', 'due',
+                                      'export', 'exported', 'created', 'updated'})
+    
+    WORD_PATTERN = re.compile(r'[a-z0-9]+')
+    NON_WORD_PATTERN = re.compile(r'[^a-z0-9]')
+    
+    # Scores at or above MATCH_THRESHOLD are trusted without the AI; MIN_MATCH_SCORE is the best-guess floor
+    MATCH_THRESHOLD = 80
+    MIN_MATCH_SCORE = 50
+    
     def __init__(self, api_key: Optional[str] = None, use_backend_service: bool = True):
         """Initialize with Claude API key or backend service"""
         self.use_backend_service = use_backend_service
         
+        # Keyword tables for header scoring, prepared once: whole-word weights for dict lookups, plus
+        # (keyword, weight) pairs for matches inside longer names, strongest first (3-letter keywords
+        # like 'gal' only count as whole words)
+        self._keyword_tables = {**self.COLUMN_KEYWORDS, 'date': self.DATE_KEYWORDS, 'time': self.TIME_KEYWORDS}
+        self._partial_keywords = {
+            field: tuple(sorted(((k, w - 15) for k, w in keywords.items() if len(k) >= 4), key=lambda kw: -kw[1]))
+            for field, keywords in self._keyword_tables.items()
+        }
+        
         if use_backend_service:
             # Use centralized backend service for SaaS
             from backend.ai_service import FleetAuditAIService
@@ -21,6 +132,9 @@ class AICsvNormalizer:
             # Direct API access (for development/testing)
             self.client = Anthropic(api_key=api_key or os.getenv('ANTHROPIC_API_KEY'))
         
+        # Known header layouts skip the AI call entirely
+        self.header_mappings = self._load_header_mappings()
+        
         # Target schema that audit logic expects
         self.target_schema = {
             'timestamp': 'datetime - transaction date and time',
@@ -33,21 +147,27 @@ class AICsvNormalizer:
     def normalize_csv(self, file_path: str) -> pd.DataFrame:
         """Convert any fuel CSV to normalized schema using AI"""
         
-        # Read the raw CSV
-        raw_df = pd.read_csv(file_path)
-        print(f"Processing CSV with {len(raw_df)} rows and columns: {list(raw_df.columns)}")
-        
-        # Get sample data for AI analysis
-        sample_size = min(5, len(raw_df))
-        sample_df = raw_df.head(sample_size)
-        
-        # Convert sample to string for AI
-        sample_csv = sample_df.to_csv(index=False)
+        # Read only the header + first rows for AI analysis - the full file is parsed once the mapping is known
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+            sample_csv = "".join(itertools.islice(f, 6))
+        header = next(csv.reader(io.StringIO(sample_csv)), [])
         
         # Get column mapping from AI
         column_mapping = self._get_ai_column_mapping(sample_csv)
         print(f"AI detected column mapping: {column_mapping}")
         
+        # Only materialize the columns the mapping actually uses
+        mapped_cols = set()
+        for source_col in column_mapping.values():
+            if isinstance(source_col, dict):
+                mapped_cols.update(source_col.values())
+            elif isinstance(source_col, str):
+                mapped_cols.add(source_col)
+        usecols = [col for col in header if col in mapped_cols]
+        
+        raw_df = self._read_csv(file_path, usecols=usecols or None)
+        print(f"Processing CSV with {len(raw_df)} rows and columns: {list(raw_df.columns)}")
+        
         # Apply mapping and normalize
         normalized_df = self._apply_mapping(raw_df, column_mapping)
         
@@ -57,14 +177,36 @@ class AICsvNormalizer:
         print(f"Successfully normalized to {len(normalized_df)} rows with schema: {list(normalized_df.columns)}")
         return normalized_df
     
+    def _read_csv(self, file_path: str, **kwargs) -> pd.DataFrame:
+        """Read a CSV with the pyarrow engine when available, otherwise the default C engine"""
+        if PYARROW_AVAILABLE:
+            try:
+                return pd.read_csv(file_path, engine='pyarrow', **kwargs)
+            except Exception as e:
+                print(f"PyArrow CSV read failed, using default parser: {e}")
+        return pd.read_csv(file_path, **kwargs)
+    
     def _get_ai_column_mapping(self, sample_csv: str) -> Dict[str, str]:
         """Use AI to analyze CSV and map columns to target schema"""
         
+        header = next(csv.reader(io.StringIO(sample_csv)), [])
+        known_mapping = self.header_mappings.get(self._header_fingerprint(header))
+        if known_mapping:
+            print("Known CSV layout - reusing stored column mapping")
+            return self._resolve_mapping(known_mapping, header)
+        
+        # Clear-cut headers are mapped locally - the AI is only asked when a field is missing or ambiguous
+        mapping, confident = self._classify_columns(header)
+        if confident:
+            print("Column mapping resolved from header names")
+            return mapping
+        
         if self.use_backend_service:
             # Use centralized backend service
             try:
                 result = self.ai_service.normalize_csv_data(sample_csv)
                 if result["success"]:
+                    self._remember_header_mapping(header, result["mapping"])
                     return result["mapping"]
                 else:
                     print(f"Backend AI service failed: {result.get('error')}")
@@ -74,41 +216,16 @@ class AICsvNormalizer:
                 return self._fallback_column_mapping(sample_csv)
         else:
             # Direct API access (development mode)
-            prompt = f"""
-You are a CSV analysis expert. Analyze this fuel card transaction CSV sample and map the columns to our target schema.
-
-TARGET SCHEMA (what we need):
-- timestamp: transaction date and time 
-- location: gas station/merchant name
-- gallons: fuel quantity in gallons
-- vehicle_id: vehicle identifier/unit number
-- amount: cost in dollars (optional)
-
-CSV SAMPLE:
-{sample_csv}
-
-INSTRUCTIONS:
-1. Identify which CSV columns map to each target schema field
-2. If date and time are separate columns, note both
-3. Handle various formats (WEX, Fleetcor, Fuelman, etc.)
-4. If a target field is missing, mark as null
-5. Consider column name variations and synonyms
-
-Return ONLY a JSON object with this exact format:
-{{
-    "timestamp": "Column Name" or {{"date_col": "Date Column", "time_col": "Time Column"}} or null,
-    "location": "Column Name" or null,
-    "gallons": "Column Name" or null, 
-    "vehicle_id": "Column Name" or null,
-    "amount": "Column Name" or null
-}}
-"""
+            # Only the sample is fresh input - the static instructions are cached in the system block
+            prompt = f"""CSV SAMPLE:
+{sample_csv}"""
             
             try:
                 response = self.client.messages.create(
                     model="claude-3-haiku-20240307",
                     max_tokens=500,
                     temperature=0.1,
+                    system=[{"type": "text", "text": self.MAPPING_PROMPT, "cache_control": {"type": "ephemeral"}}],
                     messages=[{"role": "user", "content": prompt}]
                 )
                 
@@ -121,6 +238,7 @@ Return ONLY a JSON object with this exact format:
                     mapping_text = mapping_text.split('```')[1].split('```')[0]
                 
                 mapping = json.loads(mapping_text)
+                self._remember_header_mapping(header, mapping)
                 return mapping
                 
             except Exception as e:
@@ -128,38 +246,166 @@ Return ONLY a JSON object with this exact format:
                 # Fallback to simple heuristics
                 return self._fallback_column_mapping(sample_csv)
     
+    def _header_fingerprint(self, header: List[str]) -> str:
+        """Order- and case-insensitive hash of a CSV header row"""
+        return hashlib.sha256(",".join(sorted(h.strip().lower() for h in header)).encode('utf-8')).hexdigest()
+    
+    def _load_header_mappings(self) -> Dict[str, Dict]:
+        """Load stored header fingerprint -> column mapping entries"""
+        try:
+            with open(HEADER_MAPPING_CACHE_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _resolve_mapping(self, mapping: Dict, header: List[str]) -> Dict:
+        """Point a stored mapping at this file's exact header spelling"""
+        actual = {h.strip().lower(): h for h in header}
+        resolve = lambda col: actual.get(col.strip().lower(), col) if isinstance(col, str) else col
+        
+        resolved = {}
+        for target_col, source_col in mapping.items():
+            if isinstance(source_col, dict):
+                resolved[target_col] = {key: resolve(col) for key, col in source_col.items()}
+            else:
+                resolved[target_col] = resolve(source_col)
+        return resolved
+    
+    def _remember_header_mapping(self, header: List[str], mapping: Dict):
+        """Persist an AI mapping for this header layout (only if every mapped column really exists)"""
+        columns = set(header)
+        for source_col in mapping.values():
+            for col in (source_col.values() if isinstance(source_col, dict) else [source_col]):
+                if col is not None and col not in columns:
+                    return
+        
+        fingerprint = self._header_fingerprint(header)
+        self.header_mappings[fingerprint] = mapping
+        tmp_path = None
+        try:
+            with _HEADER_MAPPING_LOCK:
+                # Merge into the file as it is now - this instance's snapshot may miss entries saved since it loaded
+                stored = self._load_header_mappings()
+                stored[fingerprint] = mapping
+                
+                # Unique temp file per write, then an atomic replace (same pattern as llm_cache.put)
+                with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(HEADER_MAPPING_CACHE_PATH),
+                                                 prefix='header_mapping_cache.', suffix='.tmp', delete=False) as f:
+                    tmp_path = f.name
+                    json.dump(stored, f, indent=2)
+                os.chmod(tmp_path, 0o644)  # NamedTemporaryFile creates 0600 files; keep the shipped file readable
+                os.replace(tmp_path, HEADER_MAPPING_CACHE_PATH)
+            self.header_mappings.update(stored)
+        except OSError as e:
+            print(f"Could not save header mapping: {e}")
+            if tmp_path:
+                with suppress(OSError):
+                    os.remove(tmp_path)
+    
     def _fallback_column_mapping(self, sample_csv: str) -> Dict[str, str]:
-        """Fallback column mapping using simple heuristics"""
-        lines = sample_csv.split('\n')
-        if len(lines) < 1:
+        """Fallback column mapping using header keyword scores (best guess per field, confident or not)"""
+        header = next(csv.reader(io.StringIO(sample_csv)), [])
+        if not header:
             return {}
-            
-        columns = [col.strip().lower() for col in lines[0].split(',')]
-        mapping = {}
-        
-        # Simple pattern matching
-        for col in columns:
-            if 'date' in col and 'time' not in col:
-                mapping['timestamp'] = col
-            elif 'time' in col:
-                if 'timestamp' in mapping and isinstance(mapping['timestamp'], str):
-                    # Convert to separate date/time format
-                    mapping['timestamp'] = {
-                        'date_col': mapping['timestamp'],
-                        'time_col': col
-                    }
-                else:
-                    mapping['timestamp'] = col
-            elif any(x in col for x in ['location', 'merchant', 'station', 'site']):
-                mapping['location'] = col
-            elif any(x in col for x in ['gallon', 'quantity', 'volume', 'liter']):
-                mapping['gallons'] = col
-            elif any(x in col for x in ['vehicle', 'unit', 'truck', 'card']):
-                mapping['vehicle_id'] = col
-            elif any(x in col for x in ['amount', 'cost', 'price', 'total']):
-                mapping['amount'] = col
-        
-        return mapping
+        
+        return self._classify_columns(header)[0]
+    
+    def _classify_columns(self, header: List[str]) -> Tuple[Dict, bool]:
+        """
+        Score every header column against each target field
+        
+        Returns the best mapping and whether it is confident: every required field
+        has a winner scoring MATCH_THRESHOLD or more, with no tie and no column used twice
+        """
+        columns = []
+        for col in header:
+            lowered = col.lower()
+            columns.append((col, set(self.WORD_PATTERN.findall(lowered)), self.NON_WORD_PATTERN.sub('', lowered)))
+        
+        mapping, picks = {}, []
+        
+        # Timestamp: one combined column, or a date column plus an optional time column
+        full_scored, date_scored, time_scored = [], [], []
+        for col, words, name in columns:
+            date_score = self._keyword_score('date', words, name)
+            time_score = self._keyword_score('time', words, name)
+            if words & self.TIMESTAMP_WORDS or (date_score and time_score):
+                full_scored.append((self._date_preference(100, words), col))
+            elif date_score:
+                date_scored.append((self._date_preference(date_score, words), col))
+            elif time_score:
+                time_scored.append((self._date_preference(time_score, words), col))
+        
+        best_full, best_date = self._best(full_scored), self._best(date_scored)
+        if best_full and (not best_date or best_full[0] >= best_date[0]):
+            mapping['timestamp'] = best_full[1]
+            picks.append(('timestamp', best_full))
+        elif best_date:
+            best_time = self._best(time_scored)
+            if best_time and best_time[0] >= self.MATCH_THRESHOLD:
+                mapping['timestamp'] = {'date_col': best_date[1], 'time_col': best_time[1]}
+                picks.append(('timestamp', best_time))
+            else:
+                mapping['timestamp'] = best_date[1]
+            picks.append(('timestamp', best_date))
+        
+        timestamp_cols = {col for _, (_, col, _) in picks}
+        for field in self.COLUMN_KEYWORDS:
+            exclusions = self.COLUMN_EXCLUSIONS.get(field, frozenset())
+            scored = [(self._keyword_score(field, words, name), col) for col, words, name in columns
+                      if col not in timestamp_cols and not words & exclusions]
+            best = self._best([(score, col) for score, col in scored if score >= self.MIN_MATCH_SCORE])
+            if best:
+                mapping[field] = best[1]
+                picks.append((field, best))
+        
+        picked_cols = [col for _, (_, col, _) in picks]
+        confident = (
+            all(field in mapping for field in ('timestamp', 'location', 'gallons', 'vehicle_id')) and
+            all(score >= self.MATCH_THRESHOLD and not tied for _, (score, _, tied) in picks) and
+            len(picked_cols) == len(set(picked_cols))
+        )
+        return mapping, confident
+    
+    def _keyword_score(self, field: str, words: set, name: str) -> float:
+        """Best keyword weight for a column: whole word > part of a longer name or a one-letter typo"""
+        keywords = self._keyword_tables[field]
+        score = 0
+        for word in words:
+            weight = keywords.get(word, 0)
+            if weight > score:
+                score = weight
+        
+        # Strongest first, so the first hit that beats the whole-word score is the best one
+        for keyword, weight in self._partial_keywords[field]:
+            if weight <= score:
+                break
+            if keyword in name:
+                score = weight
+                break
+        
+        if RAPIDFUZZ_AVAILABLE:
+            for keyword, weight in keywords.items():
+                if len(keyword) >= 5 and weight - 15 > score and any(
+                        Levenshtein.distance(word, keyword, score_cutoff=1) <= 1 for word in words):
+                    score = weight - 15
+        return score
+    
+    def _date_preference(self, score: float, words: set) -> float:
+        """Prefer transaction dates over posting/settlement dates"""
+        if words & self.PREFERRED_DATE_WORDS:
+            score += 5
+        if words & self.SECONDARY_DATE_WORDS:
+            score -= 30
+        return score
+    
+    def _best(self, scored: List[Tuple[float, str]]) -> Optional[Tuple[float, str, bool]]:
+        """Highest (score, column) plus whether another column ties with it"""
+        if not scored:
+            return None
+        ranked = sorted(scored, key=lambda item: -item[0])
+        tied = len(ranked) > 1 and ranked[1][0] == ranked[0][0]
+        return ranked[0][0], ranked[0][1], tied
     
     def _apply_mapping(self, df: pd.DataFrame, mapping: Dict[str, str]) -> pd.DataFrame:
         """Apply the column mapping to create normalized DataFrame"""
@@ -177,14 +423,14 @@ Return ONLY a JSON object with this exact format:
                     combined = df[date_col].astype(str) + ' ' + df[time_col].astype(str)
                     
                     # Parse timestamps directly - eliminate old parser dependency
-                    normalized_df['timestamp'] = pd.to_datetime(combined, errors='coerce')
+                    normalized_df['timestamp'] = self._parse_timestamps(combined)
                 elif date_col in df.columns:
-                    normalized_df['timestamp'] = pd.to_datetime(df[date_col], errors='coerce')
+                    normalized_df['timestamp'] = self._parse_timestamps(df[date_col])
             else:
                 # Single timestamp column
                 if mapping['timestamp'] in df.columns:
                     # Parse timestamps directly - eliminate old parser dependency
-                    normalized_df['timestamp'] = pd.to_datetime(df[mapping['timestamp']], errors='coerce')
+                    normalized_df['timestamp'] = self._parse_timestamps(df[mapping['timestamp']])
         
         # Handle other columns
         for target_col, source_col in mapping.items():
@@ -193,17 +439,33 @@ Return ONLY a JSON object with this exact format:
                 
             if isinstance(source_col, str) and source_col in df.columns:
                 if target_col == 'gallons' or target_col == 'amount':
-                    # Convert to numeric
-                    normalized_df[target_col] = pd.to_numeric(
-                        df[source_col].astype(str).str.replace('$', '').str.replace(',', ''), 
-                        errors='coerce'
-                    )
+                    if pd.api.types.is_numeric_dtype(df[source_col]):
+                        # Already parsed as numbers - no string cleanup needed
+                        normalized_df[target_col] = df[source_col]
+                    else:
+                        # Strip $ and thousands separators in one pass, then back to plain float64 (NA -> NaN)
+                        cleaned = df[source_col].astype(STRING_DTYPE).str.replace(r'[$,]', '', regex=True)
+                        normalized_df[target_col] = pd.to_numeric(cleaned, errors='coerce').astype('float64')
                 else:
                     # Keep as string
                     normalized_df[target_col] = df[source_col].astype(str)
         
         return normalized_df
     
+    def _parse_timestamps(self, values: pd.Series) -> pd.Series:
+        """Parse timestamps with the first known format that fits every row, else let pandas infer"""
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        
+        # cache=True parses each distinct string once - fuel exports repeat the same dates constantly
+        for fmt in self.DATETIME_FORMATS:
+            try:
+                return pd.to_datetime(values, format=fmt, errors='raise', cache=True)
+            except (ValueError, TypeError):
+                continue
+        
+        return pd.to_datetime(values, errors='coerce', cache=True)
+    
     def _validate_and_clean(self, df: pd.DataFrame) -> pd.DataFrame:
         """Validate and clean the normalized DataFrame"""
         
@@ -1,13 +1,59 @@
 import pandas as pd
 import json
-from typing import Dict, List, Optional
+import itertools
+import queue
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 from anthropic import Anthropic
 import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from parsers import llm_cache
+
+# orjson decodes large responses 2-3x faster - optional, falls back to the stdlib parser
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Bump whenever STATIC_PROMPT or the response handling changes so cached results are not reused
+PROMPT_VERSION = "2"
 
 class AIOnlyParser:
     """100% AI-powered parser - optimized for cost and performance"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    # Static instructions sent as a cached system block - must stay byte-identical across calls
+    STATIC_PROMPT = """Fleet audit expert. Analyze fuel CSV, detect violations.
+
+CRITICAL: Parse EVERY SINGLE ROW in the fuel CSV. Emit one txn line for EVERY transaction.
+
+RULES:
+1. Parse ALL CSV rows (every single transaction) - one txn line each
+2. Extract: timestamp, location, gallons, vehicle_id, amount, driver_name (if available)  
+3. Fix timestamps (skip malformed like "24:00:00")
+4. Find violations: late night, overfills, rapid refills, personal use
+5. If GPS: check truck was at station
+6. If jobs: check fuel near work sites
+
+GPS CHECKS (only when GPS DATA is provided): Match fuel locations, detect stolen cards, verify truck presence.
+
+JOB CHECKS (only when JOB DATA is provided): Match fuel to assigned sites, detect personal use.
+
+IMPORTANT: If dataset is large, you can abbreviate violations but MUST include ALL transactions as txn lines.
+
+RETURN FORMAT (JSON Lines - one compact JSON object per line, no array, no code fences):
+{"record": "txn", "timestamp": "...", "location": "...", "gallons": 0.0, "vehicle_id": "...", "amount": 0.0, "driver_name": "..."}
+{"record": "violation", "type": "...", "vehicle_id": "...", "timestamp": "...", "description": "..."}
+{"record": "summary", "total_transactions": ACTUAL_COUNT, "violations_found": VIOLATION_COUNT}
+
+Emit all txn lines first, then one violation line per violation, and the summary line last."""
+    
+    # Fuel rows per request and how many requests may run at once (keeps within API rate limits)
+    CHUNK_ROWS = 500
+    MAX_CONCURRENT_REQUESTS = 4
+    
+    def __init__(self, api_key: Optional[str] = None, llm_cache_enabled: bool = True,
+                 llm_cache_ttl: Optional[float] = 7 * 24 * 3600):
         # Try multiple ways to get API key for Streamlit compatibility
         if api_key:
             self.client = Anthropic(api_key=api_key)
@@ -25,8 +71,13 @@ class AIOnlyParser:
                 self.client = Anthropic()  # Let Anthropic handle auth
         self.primary_model = "claude-3-haiku-20240307"  # Fast & cheap
         # HAIKU ONLY - no fallback to expensive Sonnet
+        
+        # Identical uploads reuse the stored response instead of replaying the API call (ttl in seconds, None = never expire)
+        self.llm_cache_enabled = llm_cache_enabled
+        self.llm_cache_ttl = llm_cache_ttl
     
-    def parse_and_detect_violations(self, fuel_file_path: str, gps_file_path: str = None, job_file_path: str = None) -> Dict:
+    def parse_and_detect_violations(self, fuel_file_path: str, gps_file_path: str = None, job_file_path: str = None,
+                                    progress_callback: Optional[Callable[[int], None]] = None) -> Dict:
         """
         Let AI do EVERYTHING:
         1. Parse the fuel CSV
@@ -34,20 +85,23 @@ class AIOnlyParser:
         3. Cross-reference with GPS/job data if provided
         4. Detect violations
         5. Return clean results
+        
+        progress_callback, if given, receives the number of transactions parsed so far as the
+        response streams in - always on the calling thread, so it can update Streamlit elements
         """
         # Read RAW fuel CSV content
         with open(fuel_file_path, 'r') as f:
             fuel_csv_content = f.read()
         
-        # Check file size but process all data
-        fuel_csv_lines = fuel_csv_content.split('\n')
-        print(f"Processing fuel file with {len(fuel_csv_lines)} rows")
+        # Check file size but process all data (count newlines - no need to split a copy of the file)
+        fuel_row_count = fuel_csv_content.count('\n') + 1
+        print(f"Processing fuel file with {fuel_row_count} rows")
         
-        # Build optimized prompt for Haiku (RESTORE WORKING VERSION)
-        prompt = f"""Fleet audit expert. Analyze fuel CSV, detect violations.
-
-FUEL DATA:
-{fuel_csv_content}"""
+        gps_csv_content = job_csv_content = ''
+        
+        # Only the uploaded CSVs go in the user message - the static instructions are cached in the system block
+        # GPS/job sections are shared by every fuel chunk - collected as parts and joined once
+        extra_sections = []
         
         # Add RAW GPS data if provided
         if gps_file_path:
@@ -55,15 +109,9 @@ FUEL DATA:
                 with open(gps_file_path, 'r') as f:
                     gps_csv_content = f.read()
                     
-                gps_lines = gps_csv_content.split('\n')
-                print(f"Including GPS data with {len(gps_lines)} rows")
-                
-                prompt += f"""
-
-GPS DATA:
-{gps_csv_content}
-
-GPS CHECKS: Match fuel locations, detect stolen cards, verify truck presence."""
+                gps_row_count = gps_csv_content.count('\n') + 1
+                print(f"Including GPS data with {gps_row_count} rows")
+                extra_sections += ["\n\nGPS DATA:\n", gps_csv_content]
             except Exception as e:
                 print(f"Could not read GPS file: {e}")
         
@@ -73,63 +121,46 @@ GPS CHECKS: Match fuel locations, detect stolen cards, verify truck presence."""
                 with open(job_file_path, 'r') as f:
                     job_csv_content = f.read()
                     
-                job_lines = job_csv_content.split('\n')
-                print(f"Including job data with {len(job_lines)} rows")
-                    
-                prompt += f"""
-
-JOB DATA:
-{job_csv_content}
-
-JOB CHECKS: Match fuel to assigned sites, detect personal use."""
+                job_row_count = job_csv_content.count('\n') + 1
+                print(f"Including job data with {job_row_count} rows")
+                extra_sections += ["\n\nJOB DATA:\n", job_csv_content]
             except Exception as e:
                 print(f"Could not read job file: {e}")
         
-        prompt += """
-
-CRITICAL: Parse EVERY SINGLE ROW in the fuel CSV. Include ALL transactions in parsed_data array.
-
-RULES:
-1. Parse ALL CSV rows (every single transaction) - include all in parsed_data
-2. Extract: timestamp, location, gallons, vehicle_id, amount, driver_name (if available)  
-3. Fix timestamps (skip malformed like "24:00:00")
-4. Find violations: late night, overfills, rapid refills, personal use
-5. If GPS: check truck was at station
-6. If jobs: check fuel near work sites
-
-IMPORTANT: If dataset is large, you can abbreviate violations but MUST include ALL transactions in parsed_data.
-
-RETURN FORMAT:
-{
-  "parsed_data": [ALL_TRANSACTIONS_HERE],
-  "violations": [FOUND_VIOLATIONS],
-  "summary": {"total_transactions": ACTUAL_COUNT, "violations_found": VIOLATION_COUNT}
-}
-
-Return complete JSON with ALL parsed data:"""
+        # Same files + model + prompt version -> same result, skip the API call
+        cache_key = None
+        if self.llm_cache_enabled:
+            cache_key = llm_cache.make_key(fuel_csv_content, gps_csv_content, job_csv_content,
+                                           self.primary_model, PROMPT_VERSION)
+            cached = llm_cache.get(cache_key, ttl=self.llm_cache_ttl)
+            if cached and cached.get('parsed_data'):
+                print("⚡ Using cached analysis for identical files")
+                cached['dataframe'] = self._build_dataframe(cached['parsed_data'])
+                return cached
         
+        # Large fuel files go out as several smaller requests so no single response hits max_tokens
+        extra_text = "".join(extra_sections)
+        prompts = ["".join(["FUEL DATA:\n", fuel_chunk, extra_text, "\n\nReturn JSON Lines with ALL transactions:"])
+                   for fuel_chunk in self._split_csv(fuel_csv_content, self.CHUNK_ROWS)]
         
         # HAIKU ONLY - no expensive Sonnet fallback
         try:
             print("🚀 Using Claude Haiku for analysis...")
-            response = self.client.messages.create(
-                model=self.primary_model,
-                max_tokens=8000,  # Increased for months of data
-                temperature=0.1,
-                timeout=90.0,  # Longer timeout for more data
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            result_text = response.content[0].text.strip()
-            print(f"🔍 Raw AI response (first 500 chars): {result_text[:500]}...")
-            result = self._parse_ai_response(result_text)
-            
-            # Validate Haiku result (RESTORE WORKING VERSION)
-            if result and result.get('parsed_data') and len(result['parsed_data']) > 0:
-                print("✅ Haiku analysis successful!")
-                return result
+            if len(prompts) == 1:
+                on_transaction = None
+                if progress_callback is not None:
+                    received = itertools.count(1)
+                    on_transaction = lambda: progress_callback(next(received))
+                result = self._analyze(prompts[0], on_transaction)
             else:
-                raise ValueError("Haiku returned empty or invalid result")
+                print(f"Splitting fuel data into {len(prompts)} requests of up to {self.CHUNK_ROWS} rows")
+                result = self._merge_results(self._analyze_chunks(prompts, progress_callback))
+            
+            print("✅ Haiku analysis successful!")
+            # A response cut off at max_tokens is usable but not worth keeping
+            if cache_key and not result.get('summary', {}).get('truncated'):
+                llm_cache.put(cache_key, {k: v for k, v in result.items() if k != 'dataframe'})
+            return result
                 
         except Exception as e:
             error_msg = str(e)
@@ -147,11 +178,117 @@ Return complete JSON with ALL parsed data:"""
                 "summary": {"total_transactions": 0, "violations_found": 0}
             }
     
-    def _parse_ai_response(self, result_text: str) -> Dict:
-        """Parse AI response and convert to usable format"""
+    def _analyze(self, prompt: str, on_transaction: Optional[Callable[[], None]] = None) -> Dict:
+        """Send one user prompt to Haiku and return the parsed result (raises if it is empty or invalid)"""
+        # Stream the reply and decode each JSON line as soon as it is complete, overlapping parsing with the download
+        parts = []
+        with self.client.messages.stream(
+            model=self.primary_model,
+            max_tokens=8000,  # Increased for months of data
+            temperature=0.1,
+            timeout=90.0,  # Longer timeout for more data
+            system=[{"type": "text", "text": self.STATIC_PROMPT, "cache_control": {"type": "ephemeral"}}],
+            messages=[{"role": "user", "content": prompt}]
+        ) as stream:
+            lines_result = self._parse_json_lines(self._stream_lines(stream.text_stream, parts), on_transaction)
+        
+        result_text = ''.join(parts).strip()
+        print(f"🔍 Raw AI response (first 500 chars): {result_text[:500]}...")
+        result = self._parse_ai_response(result_text, lines_result)
+        
+        # Validate Haiku result (RESTORE WORKING VERSION)
+        if result and result.get('parsed_data') and len(result['parsed_data']) > 0:
+            return result
+        raise ValueError("Haiku returned empty or invalid result")
+    
+    def _analyze_chunks(self, prompts: List[str],
+                        progress_callback: Optional[Callable[[int], None]] = None) -> List[Dict]:
+        """Send several prompts concurrently and return their results in order (progress reported on this thread)"""
+        # Workers only queue a tick per transaction - Streamlit calls made from a worker thread have no
+        # script context and are dropped, so the running total is passed to progress_callback from here
+        ticks = queue.SimpleQueue()
+        on_transaction = partial(ticks.put, None) if progress_callback is not None else None
+        received = 0
+        
+        with ThreadPoolExecutor(max_workers=min(self.MAX_CONCURRENT_REQUESTS, len(prompts))) as executor:
+            futures = [executor.submit(self._analyze, prompt, on_transaction) for prompt in prompts]
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=0.2 if on_transaction else None, return_when=FIRST_COMPLETED)
+                if on_transaction is None:
+                    continue
+                
+                parsed = received
+                while not ticks.empty():
+                    ticks.get_nowait()
+                    parsed += 1
+                if parsed != received:
+                    received = parsed
+                    progress_callback(received)
+        
+        return [future.result() for future in futures]
+    
+    def _stream_lines(self, text_stream: Iterable[str], parts: List[str]) -> Iterator[str]:
+        """Yield complete lines from streamed text chunks (keeping every chunk in parts)"""
+        pending = ''
+        for text in text_stream:
+            parts.append(text)
+            pending += text
+            *complete, pending = pending.split('\n')
+            yield from complete
+        yield pending
+    
+    def _split_csv(self, csv_content: str, chunk_rows: int) -> List[str]:
+        """Split CSV text into pieces of at most chunk_rows data rows, each keeping the header"""
+        if csv_content.count('\n') <= chunk_rows:
+            return [csv_content]
+        records = self._csv_records(csv_content)
+        header, rows = records[0], [record for record in records[1:] if record.strip()]
+        if len(rows) <= chunk_rows:
+            return [csv_content]
+        return [header + '\n' + '\n'.join(rows[i:i + chunk_rows]) for i in range(0, len(rows), chunk_rows)]
+    
+    def _csv_records(self, csv_content: str) -> List[str]:
+        """Split CSV text into raw records, keeping newlines inside quoted fields (e.g. multi-line addresses)"""
+        lines = csv_content.split('\n')
+        if '"' not in csv_content:
+            return lines
+        
+        # A line continues the current record while an odd number of quotes has been seen ("" escapes pair up)
+        records, pending, open_quote = [], [], False
+        for line in lines:
+            pending.append(line)
+            open_quote ^= line.count('"') % 2 == 1
+            if not open_quote:
+                records.append('\n'.join(pending))
+                pending = []
+        if pending:
+            records.append('\n'.join(pending))
+        return records
+    
+    def _merge_results(self, results: List[Dict]) -> Dict:
+        """Combine per-chunk results and recompute the summary locally"""
+        parsed_data = [row for result in results for row in result.get('parsed_data', [])]
+        violations = [violation for result in results for violation in result.get('violations', [])]
+        summary = {"total_transactions": len(parsed_data), "violations_found": len(violations)}
+        if any(result.get('summary', {}).get('truncated') for result in results):
+            summary['truncated'] = True
+        
+        return {
+            "parsed_data": parsed_data,
+            "dataframe": self._build_dataframe(parsed_data),
+            "violations": violations,
+            "summary": summary
+        }
+    
+    def _parse_ai_response(self, result_text: str, lines_result: Optional[Dict] = None) -> Dict:
+        """Parse AI response and convert to usable format (lines_result: JSON Lines already parsed while streaming)"""
         try:
-            # Extract JSON - handle text before JSON
-            if '```json' in result_text:
+            result = lines_result if lines_result is not None else self._parse_json_lines(result_text.splitlines())
+            if result is not None:
+                print(f"🔍 Parsed {len(result['parsed_data'])} transactions from JSON Lines")
+            # Extract JSON - handle text before JSON (single-object responses)
+            elif '```json' in result_text:
                 json_text = result_text.split('```json')[1].split('```')[0]
                 print(f"🔍 Extracted JSON from ```json blocks")
             elif '```' in result_text:
@@ -166,19 +303,72 @@ Return complete JSON with ALL parsed data:"""
                 json_text = result_text
                 print(f"🔍 Using raw response as JSON")
             
-            print(f"🔍 JSON to parse (first 200 chars): {json_text[:200]}...")
-            result = json.loads(json_text)
+            if result is None:
+                print(f"🔍 JSON to parse (first 200 chars): {json_text[:200]}...")
+                result = self._loads(json_text)
             
             # Convert parsed_data to DataFrame (RESTORE WORKING VERSION)
             if result.get('parsed_data'):
-                df = pd.DataFrame(result['parsed_data'])
-                if 'timestamp' in df.columns:
-                    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-                result['dataframe'] = df
+                result['dataframe'] = self._build_dataframe(result['parsed_data'])
             
             return result
             
         except Exception as e:
             print(f"❌ Failed to parse AI response: {e}")
             print(f"❌ Raw response: {result_text}")
-            return None
\ No newline at end of file
+            return None
+    
+    def _parse_json_lines(self, lines: Iterable[str], on_transaction: Optional[Callable[[], None]] = None) -> Optional[Dict]:
+        """Collect txn/violation/summary lines; None if the response isn't JSON Lines"""
+        parsed_data, violations, summary = [], [], None
+        for line in lines:
+            line = line.strip()
+            if not line.startswith('{'):
+                continue  # blank lines, prose, code fences
+            try:
+                record = self._loads(line)
+            except ValueError:
+                continue  # e.g. the last line cut off at max_tokens - keep everything before it
+            if not isinstance(record, dict):
+                continue
+            
+            kind = record.pop('record', None)
+            if kind == 'txn':
+                parsed_data.append(record)
+                if on_transaction is not None:
+                    on_transaction()
+            elif kind == 'violation':
+                violations.append(record)
+            elif kind == 'summary':
+                summary = record
+        
+        if not parsed_data and not violations and summary is None:
+            return None
+        
+        if summary is None:
+            print("⚠️ Response ended before the summary line - using the rows received")
+            summary = {"total_transactions": len(parsed_data), "violations_found": len(violations), "truncated": True}
+        
+        return {"parsed_data": parsed_data, "violations": violations, "summary": summary}
+    
+    def _loads(self, json_text: str):
+        """Decode JSON with orjson when available (stdlib json still accepts NaN and oversized ints)"""
+        if ORJSON_AVAILABLE:
+            try:
+                return orjson.loads(json_text)
+            except orjson.JSONDecodeError:
+                pass
+        return json.loads(json_text)
+    
+    def _build_dataframe(self, parsed_data: List[Dict]) -> pd.DataFrame:
+        """Convert parsed_data rows to a DataFrame with parsed timestamps and numeric quantities"""
+        # pandas converts a list of dicts in C - faster than building per-column lists in Python
+        df = pd.DataFrame(parsed_data)
+        if 'timestamp' in df.columns:
+            # Transactions share dates heavily - cache=True parses each distinct string once
+            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce', cache=True)
+        for col in ('gallons', 'amount'):
+            # A single quoted number or null in the response would otherwise leave the whole column as object
+            if col in df.columns and df[col].dtype == object:
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
\ No newline at end of file
@@ -0,0 +1,47 @@
+import os
+import contextlib
+import json
+import time
+import hashlib
+import tempfile
+from typing import Dict, Optional
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'llm_cache')
+
+def make_key(*parts) -> str:
+    """SHA-256 over the given byte/str parts (length-prefixed so boundaries can't collide)"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        h.update(len(part).to_bytes(8, 'big'))
+        h.update(part)
+    return h.hexdigest()
+
+def get(key: str, ttl: Optional[float] = None) -> Optional[Dict]:
+    """Return the cached response for key, or None on a miss or an expired entry"""
+    path = os.path.join(CACHE_DIR, f'{key}.json')
+    try:
+        if ttl is not None and time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def put(key: str, value: Dict) -> None:
+    """Store a JSON-serializable response under key (written atomically)"""
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Unique temp file per write, so threads or processes storing the same key never share one
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=CACHE_DIR, prefix=f'{key}.',
+                                         suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+            json.dump(value, f, default=str)
+        os.replace(tmp_path, os.path.join(CACHE_DIR, f'{key}.json'))
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Could not write LLM cache entry: {e}")
+        if tmp_path:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
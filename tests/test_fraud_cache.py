@@ -0,0 +1,60 @@
+"""Cached fraud analysis: reruns on the same prompt must replay cleanly without calling Claude again"""
+import contextlib
+import os
+import sys
+from types import SimpleNamespace
+
+from streamlit.testing.v1 import AppTest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import app
+
+REPLY = '{"violations": [{"type": "after_hours_fuel", "severity": "high"}], "summary": {"total_estimated_loss": 75.5}}'
+
+class FakeClaude:
+    """Stands in for the Anthropic client - counts requests and streams REPLY in small chunks"""
+    
+    def __init__(self):
+        self.calls = 0
+        self.messages = self
+    
+    def stream(self, **kwargs):
+        self.calls += 1
+        chunks = [REPLY[i:i + 7] for i in range(0, len(REPLY), 7)]
+        return contextlib.nullcontext(SimpleNamespace(text_stream=chunks))
+
+def fraud_page(client, prompt):
+    """Minimal page around the fraud call, laid out like _fraud_analysis"""
+    import streamlit as st
+    import app
+    
+    app._anthropic_client = lambda: client
+    progress = st.empty()
+    fraud_results = app._fraud_results(prompt, progress)
+    progress.empty()
+    st.text(f"violations: {len(fraud_results['violations'])}")
+
+def test_repeat_run_uses_cached_analysis():
+    client = FakeClaude()
+    at = AppTest.from_function(fraud_page, args=(client, "repeat run"), default_timeout=30)
+    
+    for _ in range(2):
+        at.run()
+        assert not at.exception
+        assert not at.error
+        assert [text.value for text in at.text] == ["violations: 1"]
+    
+    assert client.calls == 1
+
+def test_cache_is_keyed_on_prompt_and_version(monkeypatch):
+    client = FakeClaude()
+    runs = [("same data", "1"), ("same data", "1"), ("other data", "1"), ("same data", "2")]
+    
+    for prompt, prompt_version in runs:
+        monkeypatch.setattr(app, 'PROMPT_VERSION', prompt_version)
+        at = AppTest.from_function(fraud_page, args=(client, prompt), default_timeout=30)
+        at.run()
+        assert not at.exception
+        assert not at.error
+    
+    assert client.calls == 3
@@ -0,0 +1,53 @@
+"""GPS helpers in logic.utils on naive and tz-aware timestamp columns"""
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from logic.utils import detect_idle_periods, find_gps_near_location, is_business_hours, is_within_time_window
+
+def gps_frame(timestamps):
+    return pd.DataFrame({
+        'vehicle_id': 'TRUCK-001',
+        'timestamp': pd.to_datetime(timestamps),
+        'lat': 40.0,
+        'lon': -75.0,
+        'speed_mph': 0.0
+    })
+
+TIMES = ['2024-06-01T12:00:00', '2024-06-01T12:05:00', '2024-06-01T12:10:00',
+         '2024-06-01T12:15:00', '2024-06-01T12:20:00', '2024-06-01T12:25:00']
+
+def test_find_gps_near_location_naive():
+    found = find_gps_near_location(gps_frame(TIMES), 40.0, -75.0, pd.Timestamp('2024-06-01 12:12'))
+    assert len(found) == 6
+
+def test_find_gps_near_location_tz_aware():
+    gps_df = gps_frame([time + 'Z' for time in TIMES])
+    assert str(gps_df['timestamp'].dt.tz) == 'UTC'
+    
+    assert len(find_gps_near_location(gps_df, 40.0, -75.0, pd.Timestamp('2024-06-01 12:12', tz='UTC'))) == 6
+    # Same instant expressed in another zone, and a naive time read in the column's zone
+    assert len(find_gps_near_location(gps_df, 40.0, -75.0, pd.Timestamp('2024-06-01 08:12', tz='US/Eastern'))) == 6
+    assert len(find_gps_near_location(gps_df, 40.0, -75.0, pd.Timestamp('2024-06-01 12:12'))) == 6
+    assert find_gps_near_location(gps_df, 40.0, -75.0, pd.Timestamp('2024-06-01 14:00', tz='UTC')).empty
+
+def test_detect_idle_periods_keeps_timezone():
+    for suffix, tz in (('', None), ('Z', 'UTC')):
+        periods = detect_idle_periods(gps_frame([time + suffix for time in TIMES]))
+        
+        assert len(periods) == 1
+        assert periods[0]['duration_minutes'] == 25.0
+        assert periods[0]['start_time'] == pd.Timestamp('2024-06-01 12:00', tz=tz)
+        assert periods[0]['end_time'] == pd.Timestamp('2024-06-01 12:25', tz=tz)
+
+def test_time_helpers_treat_pd_na_as_missing():
+    timestamp = pd.Timestamp('2024-06-03 10:00')
+    for missing in (None, pd.NA, pd.NaT, float('nan')):
+        assert not is_within_time_window(missing, timestamp)
+        assert not is_within_time_window(timestamp, missing)
+        assert not is_business_hours(missing)
+    
+    assert is_within_time_window(timestamp, timestamp)
+    assert is_business_hours(timestamp)